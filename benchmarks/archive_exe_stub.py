@@ -0,0 +1,85 @@
+"""
+A stand-in for Archive.exe, so the Archive.exe backend can be benchmarked without the Creation Kit.
+It understands the same scripts that pigroman writes, and packs the archives with the Python BSA packer.
+The stub is a Python script called Archive.exe, so it runs only on systems that honor shebangs (not on Windows).
+"""
+import os
+import stat
+import sys
+from typing import List, Optional
+
+import bsa
+
+
+def install(folder: str, startup_delay: float = 0.0) -> str:
+    """
+    Creates an executable Archive.exe stub
+
+    :param folder: folder where Archive.exe is created
+    :param startup_delay: seconds the stub waits before running the script, to simulate the startup time of Archive.exe
+    :return: path of the stub
+    """
+    path = os.path.join(folder, "Archive.exe")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(path, "w") as f:
+        f.write(
+            f"#!{sys.executable}\n"
+            "import sys\n"
+            "import time\n"
+            f"time.sleep({startup_delay!r})\n"
+            f"sys.path.insert(0, {root!r})\n"
+            "from benchmarks.archive_exe_stub import main\n"
+            "sys.exit(main(sys.argv[1:]))\n"
+        )
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+def main(args: List[str]) -> int:
+    """
+    Runs an Archive.exe script
+
+    :param args: command line arguments (path of the script, relative to the working directory)
+    :return: exit code
+    """
+    archive: Optional[bsa.BSAArchive] = None
+    compress = False
+    root = ""
+    log_lines = []
+    log_path = None
+    with open(args[0], "r") as f:
+        for line in f:
+            command, _, value = line.strip().partition(": ")
+            if command == "Log":
+                log_path = value
+            elif command == "New Archive":
+                archive = None
+                compress = False
+                root = ""
+            elif command == "Check" and value == "Compress Archive":
+                compress = True
+            elif command == "Set File Group Root":
+                root = value
+            elif command == "Add File Group":
+                archive = bsa.BSAArchive(
+                    root,
+                    archive_flags=bsa.ArchiveFlags.BETHESDA_DEFAULTS
+                    | (bsa.ArchiveFlags.COMPRESSED_ARCHIVE if compress else 0)
+                )
+                with open(value, "r") as files_list:
+                    for file_line in files_list:
+                        file_line = file_line.strip()
+                        if file_line:
+                            archive.add_file(os.path.join(archive.base_dir, file_line.replace("\\", os.sep)))
+                            log_lines.append(f"Added {file_line}")
+            elif command == "Save Archive":
+                if archive is None:
+                    log_lines.append("No files to save")
+                    continue
+                with open(value, "wb") as out:
+                    archive.write(out)
+                log_lines.append(f"Saved {value}")
+    if log_path is not None:
+        with open(log_path, "w") as f:
+            f.writelines(f"{x}\n" for x in log_lines)
+    return 0
@@ -0,0 +1,89 @@
+"""
+Checks and times the batching of several blocks in a single Archive.exe run (--batch),
+with a stand-in Archive.exe (see benchmarks.archive_exe_stub), so it doesn't run on Windows.
+
+It checks the contents of the scripts, the archives and the per-archive logs,
+then packs the same blocks with different batch sizes and compares the times with a simple model:
+time = time of a single run + (number of runs - 1) * startup time of Archive.exe.
+
+Usage: python -m benchmarks.batching [blocks count] [files per block] [Archive.exe startup delay in ms]
+"""
+import math
+import os
+import sys
+import tempfile
+import time
+
+import bsa
+from benchmarks import archive_exe_stub
+from utils.backends import ArchiveExeBackend
+from utils.files import ListSize
+from utils.metrics import Metrics
+from utils.scheduler import JobStatus, schedule_blocks
+
+
+def main(blocks_count: int = 16, files_per_block: int = 20, startup_delay_ms: int = 200) -> None:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data")
+        output_folder = os.path.join(tmp, "out")
+        tool_folder = os.path.join(tmp, "archive")
+        os.makedirs(output_folder)
+        os.makedirs(tool_folder)
+        archive_exe_stub.install(tool_folder, startup_delay=startup_delay_ms / 1000)
+        lists_sizes = []
+        for i in range(blocks_count):
+            folder = os.path.join(data_path, "meshes", f"block{i}")
+            os.makedirs(folder)
+            with open(os.path.join(tmp, f"out_{i}.txt"), "w") as files_list:
+                for j in range(files_per_block):
+                    with open(os.path.join(folder, f"file{j}.nif"), "wb") as f:
+                        f.write(os.urandom(4096))
+                    files_list.write(f"meshes{os.sep}block{i}{os.sep}file{j}.nif\n")
+            lists_sizes.append(ListSize(files_per_block, files_per_block * 4096, files_per_block * 4096))
+        packer = ArchiveExeBackend(
+            data_path=data_path, output_folder=output_folder, output_name="batch", compress=False,
+            archive_tool_path=tool_folder
+        )
+
+        # A section for each block, in the same order
+        script = packer.script([0, 1, 2], "log.txt")
+        assert script[0] == "Log: log.txt"
+        assert script.count("New Archive") == 3
+        assert [x for x in script if x.startswith("Save Archive: ")] == [
+            f"Save Archive: {packer.archive_path(i)}" for i in range(3)
+        ]
+
+        # The scheduler reads the files lists from the working directory
+        os.chdir(tmp)
+        times = {}
+        try:
+            for batch_size in sorted({1, 2, 4, blocks_count}):
+                for x in os.listdir(output_folder):
+                    os.remove(os.path.join(output_folder, x))
+                st = time.monotonic()
+                results = schedule_blocks(packer, lists_sizes, 1, Metrics(), batch_size=batch_size)
+                times[batch_size] = time.monotonic() - st
+                assert all(x.status == JobStatus.DONE for x in results)
+
+                # Each archive has the right files, and each block has its own log
+                for i in range(blocks_count):
+                    with bsa.BSAReader(packer.archive_path(i)) as reader:
+                        assert len(reader) == files_per_block
+                    with open(os.path.join(tool_folder, f"log_{i}.txt"), "r") as f:
+                        saved = [x for x in f if x.startswith("Saved ")]
+                    assert saved == [f"Saved {packer.archive_path(i)}\n"], saved
+        finally:
+            os.chdir(cwd)
+
+    # Startup time, estimated from the runs with one block per run and with all the blocks in one run
+    startup = (times[1] - times[blocks_count]) / (blocks_count - 1)
+    print(f"* {blocks_count} blocks, {files_per_block} files each, estimated startup time {startup * 1000:.0f} ms")
+    for batch_size, elapsed in times.items():
+        runs = math.ceil(blocks_count / batch_size)
+        predicted = times[blocks_count] + (runs - 1) * startup
+        print(f"* Batch size {batch_size:>3}: {runs:>3} runs, {elapsed:.2f} s (model: {predicted:.2f} s)")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
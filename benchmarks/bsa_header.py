@@ -0,0 +1,42 @@
+"""
+Writes archives with an increasing number of (empty) files and reports the time
+needed to index the files and write the header. The time per entry should stay
+about the same as the number of entries grows.
+
+Usage: python -m benchmarks.bsa_header [max files count]
+"""
+import os
+import sys
+import tempfile
+
+import bsa
+
+
+def main(max_files_count: int = 300000) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data")
+        paths = []
+        files_count = 25000
+        while files_count <= max_files_count:
+            # Create the missing files
+            for i in range(len(paths), files_count):
+                folder = os.path.join(data_path, "meshes", f"folder{i // 100}")
+                if i % 100 == 0:
+                    os.makedirs(folder, exist_ok=True)
+                path = os.path.join(folder, f"file{i}.nif")
+                open(path, "wb").close()
+                paths.append(path)
+
+            archive = bsa.BSAArchive(data_path)
+            archive.add_files(*paths)
+            with open(os.path.join(tmp, "out.bsa"), "wb") as f:
+                archive.write(f)
+            print(
+                f"* {files_count} files: header {archive.header_write_time:.2f} s "
+                f"({archive.header_write_time / files_count * 1000000:.2f} us per entry)"
+            )
+            files_count *= 2
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
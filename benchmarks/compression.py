@@ -0,0 +1,55 @@
+"""
+Writes the same compressed archive with an increasing number of worker processes
+and reports the compression throughput, in total and per core.
+
+Usage: python -m benchmarks.compression [files count] [file size in KB]
+"""
+import os
+import random
+import sys
+import tempfile
+
+import bsa
+
+
+def make_data(rng: random.Random, size: int) -> bytes:
+    # Half random bytes, half repeated patterns: compresses to roughly 50%
+    r = bytearray()
+    while len(r) < size:
+        r.extend(rng.getrandbits(256 * 8).to_bytes(256, "little"))
+        r.extend(bytes([rng.randrange(256)]) * 256)
+    return bytes(r[:size])
+
+
+def main(files_count: int = 400, file_size_kb: int = 1024) -> None:
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data")
+        paths = []
+        for i in range(files_count):
+            folder = os.path.join(data_path, "textures", f"folder{i // 50}")
+            os.makedirs(folder, exist_ok=True)
+            path = os.path.join(folder, f"file{i}.dds")
+            with open(path, "wb") as f:
+                f.write(make_data(rng, file_size_kb * 1024))
+            paths.append(path)
+
+        workers = 1
+        while workers <= os.cpu_count():
+            archive = bsa.BSAArchive(
+                data_path, archive_flags=bsa.ArchiveFlags.BETHESDA_DEFAULTS | bsa.ArchiveFlags.COMPRESSED_ARCHIVE
+            )
+            archive.add_files(*paths)
+            with open(os.path.join(tmp, "out.bsa"), "wb") as f:
+                archive.write(f, workers=workers)
+            mb_s = archive.raw_data_size / 1024 / 1024 / archive.data_write_time
+            print(
+                f"* {workers} workers: {archive.data_write_time:.2f} s, {mb_s:.0f} MB/s, "
+                f"{mb_s / workers:.0f} MB/s per core, "
+                f"ratio {archive.stored_data_size / archive.raw_data_size * 100:.1f}%"
+            )
+            workers *= 2
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
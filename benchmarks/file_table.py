@@ -0,0 +1,98 @@
+"""
+Measures the memory used to keep track of the files of a big Data folder: the File objects,
+the container used by pigroman.main and the blocks made by the greedy planner.
+Compares the current File (slots, shared folder names, blocks of indexes) with the previous layout
+(an instance dict per file, the absolute path and a copy of the base dir in each file, a path -> File dict
+and blocks of File objects), on a synthetic list of files (nothing is written to disk).
+
+Usage: python -m benchmarks.file_table [files count] [files per folder]
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+from utils.files import File
+from utils.planner import GreedyPlanner
+
+
+class DictFile:
+    """
+    The previous File layout
+    """
+
+    def __init__(self, path: str, base_dir: str, size: int, mtime_ns: int = 0):
+        self.path = path.lower().strip()
+        self.base_dir = base_dir.lower().strip()
+        self.size = size
+        self.estimated_size = size
+        self.mtime_ns = mtime_ns
+        self.copied = False
+
+
+def synthetic_paths(data_path: str, files_count: int, files_per_folder: int):
+    for i in range(files_count):
+        folder = i // files_per_folder
+        yield os.path.join(
+            data_path, "textures", f"mod{folder // 100}", f"folder{folder}", f"texture_file_{i}_n.dds"
+        ), 1000 + i % 100000
+
+
+def old_layout(data_path: str, files_count: int, files_per_folder: int, max_block_size: int):
+    files = {}
+    for path, size in synthetic_paths(data_path, files_count, files_per_folder):
+        file = DictFile(path, data_path, size, mtime_ns=time.time_ns())
+        files[file.path] = file
+    blocks = []
+    block = []
+    block_size = 0
+    for file in files.values():
+        block.append(file)
+        block_size += file.estimated_size
+        if block_size >= max_block_size:
+            blocks.append(block)
+            block = []
+            block_size = 0
+    blocks.append(block)
+    return files, blocks
+
+
+def new_layout(data_path: str, files_count: int, files_per_folder: int, max_block_size: int):
+    files = [
+        File(path, data_path, size, mtime_ns=time.time_ns())
+        for path, size in synthetic_paths(data_path, files_count, files_per_folder)
+    ]
+    return files, GreedyPlanner(max_block_size).plan(files)
+
+
+def measure(f: Callable[[], object]) -> Tuple[int, float]:
+    gc.collect()
+    tracemalloc.start()
+    st = time.monotonic()
+    result = f()
+    elapsed = time.monotonic() - st
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, elapsed
+
+
+def main(files_count: int = 2000000, files_per_folder: int = 50) -> None:
+    data_path = os.path.join(os.sep, "games", "skyrim special edition", "data")
+    max_block_size = 700 * 1024 * 1024
+    print(f"* {files_count} files, {files_per_folder} files per folder")
+    results = {}
+    for name, layout in (("dict", old_layout), ("slots", new_layout)):
+        used, elapsed = measure(lambda: layout(data_path, files_count, files_per_folder, max_block_size))
+        results[name] = used
+        print(
+            f"* {name:<6} {used / 1024 / 1024:.0f} MB, {used / files_count:.0f} bytes per file, "
+            f"built in {elapsed:.2f} s"
+        )
+    print(f"* {results['dict'] / results['slots']:.1f}x less memory")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -0,0 +1,59 @@
+"""
+Measures the cost of the filter rules (utils.filters.FileFilter) while scanning a Data folder with a big folder:
+excluding the big folder should cost about the same as not having it at all, as it's never listed.
+Also times the file rules (globs, extensions, sizes), checked on every file.
+
+Usage: python -m benchmarks.filters [files in the big folder] [files in the other folder]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from utils.filters import FileFilter
+from utils.scanner import Scanner
+
+
+def scan(data_path: str, folders, file_filter: FileFilter) -> float:
+    scanner = Scanner(data_path, file_filter=file_filter)
+    st = time.monotonic()
+    for _ in scanner.scan([os.path.join(data_path, x) for x in folders]):
+        pass
+    return time.monotonic() - st
+
+
+def main(big_files_count: int = 50000, files_count: int = 5000) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data")
+        for folder, count in (("big", big_files_count), ("small", files_count)):
+            for i in range(count):
+                sub = os.path.join(data_path, "textures", folder, f"folder{i // 1000}")
+                if i % 1000 == 0:
+                    os.makedirs(sub)
+                with open(os.path.join(sub, f"file{i}.{'dds' if i % 2 else 'nif'}"), "wb") as f:
+                    f.write(bytes(i % 2048))
+
+        big = os.path.join(data_path, "textures", "big")
+        small = os.path.join("textures", "small")
+        # Warm up the OS cache
+        scan(data_path, ["textures"], FileFilter(data_path))
+        runs = (
+            ("small folder only", [small], FileFilter(data_path)),
+            ("big folder excluded", ["textures"], FileFilter(data_path, exclude_folders=[big])),
+            ("no rules", ["textures"], FileFilter(data_path)),
+            ("file rules", ["textures"], FileFilter(
+                data_path, exclude_globs=["*7.dds", "textures/*/folder1/*"], exclude_extensions=["nif"],
+                min_size=16, max_size=2000
+            )),
+        )
+        for name, folders, file_filter in runs:
+            elapsed = scan(data_path, folders, file_filter)
+            print(f"* {name:<20} {elapsed:.3f} s")
+            for rule in file_filter.rules:
+                print(
+                    f"  '{rule.description}': {rule.skipped_folders} folders, {rule.skipped_files} files skipped"
+                )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -0,0 +1,100 @@
+"""
+Generates synthetic "Data" folders, with a realistic mix of file types and sizes.
+
+Usage: python -m benchmarks.generator output_path [files count]
+"""
+import os
+import random
+import shutil
+import sys
+from collections import namedtuple
+from typing import Dict, List, Tuple
+
+from bsa import FILE_FLAGS_EXTENSIONS_MAPPING
+
+# extension -> (top level folder, relative frequency, median size in bytes)
+EXTENSIONS: Dict[str, Tuple[str, int, int]] = {
+    ".nif": ("meshes", 30, 64 * 1024),
+    ".dds": ("textures", 40, 256 * 1024),
+    ".xml": ("meshes", 3, 4 * 1024),
+    ".wav": ("sound", 4, 128 * 1024),
+    ".fuz": ("sound", 10, 32 * 1024),
+    ".mp3": ("music", 1, 2 * 1024 * 1024),
+    ".ogg": ("music", 2, 1024 * 1024),
+    ".txt": ("shadersfx", 1, 2 * 1024),
+    ".htm": ("shadersfx", 1, 4 * 1024),
+    ".bat": ("shadersfx", 1, 1024),
+    ".scc": ("shadersfx", 1, 16 * 1024),
+    ".spt": ("trees", 1, 32 * 1024),
+    ".fnt": ("interface", 1, 64 * 1024),
+    ".tex": ("interface", 1, 16 * 1024),
+}
+assert EXTENSIONS.keys() == FILE_FLAGS_EXTENSIONS_MAPPING.keys()
+
+DataTree = namedtuple("DataTree", "data_path folders files_count total_size duplicates_count duplicates_size")
+
+
+def generate_data_tree(
+    path: str, files_count: int = 2000, depth: int = 3, duplicate_ratio: float = 0.1,
+    size_scale: float = 0.25, files_per_folder: int = 50, seed: int = 0
+) -> DataTree:
+    """
+    Generates a synthetic "Data" folder. The same arguments always generate the same files.
+    File sizes follow a log-normal distribution around the median size of each extension,
+    and each file is half random bytes and half zeros, so the archives can be compressed.
+
+    :param path: folder where the "Data" folder is created
+    :param files_count: number of files to generate
+    :param depth: number of nested folders between the top level folders (meshes, textures, ...) and the files
+    :param duplicate_ratio: fraction of the files that are copies of another file with the same extension
+    :param size_scale: all median sizes are multiplied by this
+    :param files_per_folder: number of files in each folder
+    :param seed: random seed
+    :return: a DataTree
+    """
+    rng = random.Random(seed)
+    data_path = os.path.join(path, "data")
+    extensions = list(EXTENSIONS)
+    weights = [EXTENSIONS[x][1] for x in extensions]
+
+    # extension -> (path, size) of the unique files generated so far, used to pick duplicates
+    generated: Dict[str, List[Tuple[str, int]]] = {x: [] for x in extensions}
+    folders = set()
+    total_size = 0
+    duplicates_count = 0
+    duplicates_size = 0
+    for i in range(files_count):
+        extension = rng.choices(extensions, weights)[0]
+        top_folder, _, median_size = EXTENSIONS[extension]
+        folders.add(top_folder)
+        folder_i = i // files_per_folder
+        folder = os.path.join(
+            data_path, top_folder,
+            *(f"level{level}_{folder_i % (level + 2)}" for level in range(depth - 1)),
+            f"folder{folder_i}"
+        )
+        os.makedirs(folder, exist_ok=True)
+        file_path = os.path.join(folder, f"file{i}{extension}")
+        if generated[extension] and rng.random() < duplicate_ratio:
+            original_path, size = rng.choice(generated[extension])
+            shutil.copyfile(original_path, file_path)
+            duplicates_count += 1
+            duplicates_size += size
+        else:
+            size = max(1, int(rng.lognormvariate(0, 1) * median_size * size_scale))
+            random_size = size // 2
+            with open(file_path, "wb") as f:
+                if random_size > 0:
+                    f.write(rng.getrandbits(random_size * 8).to_bytes(random_size, "little"))
+                f.write(bytes(size - random_size))
+            generated[extension].append((file_path, size))
+        total_size += size
+    return DataTree(data_path, sorted(folders), files_count, total_size, duplicates_count, duplicates_size)
+
+
+if __name__ == "__main__":
+    tree = generate_data_tree(sys.argv[1], *(int(x) for x in sys.argv[2:]))
+    print(
+        f"* Generated {tree.files_count} files ({tree.total_size / 1024 / 1024:.0f} MB) in {tree.data_path}, "
+        f"{tree.duplicates_count} duplicates ({tree.duplicates_size / 1024 / 1024:.0f} MB)"
+    )
@@ -0,0 +1,57 @@
+"""
+Compares the old whole-file hashing with the streaming hasher in utils.hashing.
+Reports time and peak (Python) memory for each method.
+
+Usage: python -m benchmarks.hashing [size in MB]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+import xxhash
+
+from utils.hashing import file_hash
+
+
+def read_all_hash(path: str) -> int:
+    with open(path, "rb") as f:
+        return xxhash.xxh64_intdigest(f.read())
+
+
+def measure(f: Callable[[str], int], path: str) -> Tuple[int, float, int]:
+    tracemalloc.start()
+    st = time.monotonic()
+    r = f(path)
+    et = time.monotonic()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return r, et - st, peak
+
+
+def main(size_mb: int = 512) -> None:
+    fd, path = tempfile.mkstemp(suffix=".dds")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            chunk = os.urandom(1024 * 1024)
+            for _ in range(size_mb):
+                f.write(chunk)
+        results = {}
+        for name, f in (("read all", read_all_hash), ("streaming", file_hash)):
+            digest, elapsed, peak = measure(f, path)
+            results[name] = digest
+            print(
+                f"* {name:<10} {elapsed:.2f} s, {size_mb / elapsed:.0f} MB/s, "
+                f"peak memory {peak / 1024 / 1024:.2f} MB"
+            )
+        if len(set(results.values())) != 1:
+            sys.exit("! Digests do not match")
+        print("* Digests match")
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -0,0 +1,63 @@
+"""
+Measures how the hashing of the duplicates (utils.dedup.TieredDeduplicator) scales with the number of workers,
+with a pool of threads and with a pool of processes.
+All files have the same size and the same first and last bytes, so every file is hashed entirely.
+The files are read once before the runs, so they're in the OS cache and the runs measure the CPU side:
+to measure a device, drop the OS cache before each run (eg: echo 3 > /proc/sys/vm/drop_caches).
+It also checks that all runs find the same groups, in the same order.
+
+Usage: python -m benchmarks.hashing_pipeline [files count] [file size in MB] [max workers]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from utils.dedup import PARTIAL_SIZE, TieredDeduplicator
+from utils.files import File
+
+
+def main(files_count: int = 256, size_mb: int = 4, max_workers: int = 0) -> None:
+    if max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    size = size_mb * 1024 * 1024
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data")
+        os.makedirs(os.path.join(data_path, "textures"))
+        paths = []
+        for i in range(files_count):
+            path = os.path.join(data_path, "textures", f"file{i}.dds")
+            with open(path, "wb") as f:
+                f.write(bytes(PARTIAL_SIZE))
+                # One file out of 4 has a duplicate
+                f.write(os.urandom(size - 2 * PARTIAL_SIZE) if i % 4 else bytes(size - 2 * PARTIAL_SIZE))
+                f.write(bytes(PARTIAL_SIZE))
+            paths.append(path)
+
+        workers_counts = sorted({1 << x for x in range(max_workers.bit_length())} | {max_workers})
+        base_time = None
+        groups = None
+        for use_processes in (False, True):
+            for workers in workers_counts:
+                if use_processes and workers == 1:
+                    continue
+                files = [File(x, data_path, size) for x in paths]
+                deduplicator = TieredDeduplicator(workers=workers, use_processes=use_processes)
+                st = time.monotonic()
+                duplicates = deduplicator.find(files)
+                elapsed = time.monotonic() - st
+                result = [sorted(x.path for x in v) for v in duplicates.values()]
+                if groups is None:
+                    groups, base_time = result, elapsed
+                elif result != groups:
+                    sys.exit("! Different groups of identical files")
+                print(
+                    f"* {workers:>2} {'processes' if use_processes else 'threads':<9} {elapsed:.2f} s, "
+                    f"{deduplicator.bytes_read / 1024 / 1024 / elapsed:.0f} MB/s, "
+                    f"speedup {base_time / elapsed:.2f}x"
+                )
+        print(f"* {len(groups)} groups of identical files, same groups in all runs")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
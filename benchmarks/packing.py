@@ -0,0 +1,74 @@
+"""
+Packs a synthetic Data folder with the native backend and reports the
+end-to-end packing throughput. Does not need Archive.exe.
+The Data folder has mixed-case names (Data/Textures/Foo.dds), so it also checks that files are read
+with their case on disk, and stored in lower case in the archives.
+
+Usage: python -m benchmarks.packing [files count] [max block size in MB] [parallel]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+import bsa
+import pigroman
+from utils.backends import NativeBackend
+
+
+def main(files_count: int = 5000, max_block_size_mb: int = 64, parallel: int = 2) -> None:
+    rng = random.Random(0)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "Data")
+        output_folder = os.path.join(tmp, "out")
+        os.makedirs(output_folder)
+        total_size = 0
+        for i in range(files_count):
+            folder = os.path.join(data_path, "Textures", f"Folder{i // 100}")
+            os.makedirs(folder, exist_ok=True)
+            size = rng.randrange(1024, 128 * 1024)
+            with open(os.path.join(folder, f"File{i}.dds"), "wb") as f:
+                f.write(os.urandom(size))
+            total_size += size
+        with open(os.path.join(data_path, "Textures", "Foo.dds"), "wb") as f:
+            f.write(b"foo")
+        files_count += 1
+        total_size += 3
+
+        # main writes the files lists in the working directory
+        os.chdir(tmp)
+        try:
+            st = time.monotonic()
+            pigroman.main(
+                data_path=data_path,
+                folders_to_pack=["Textures"],
+                output_folder=output_folder,
+                output_name="bench",
+                archive_tool_path=None,
+                max_block_size=max_block_size_mb * 1024 * 1024,
+                create_esl=False,
+                max_workers=parallel,
+                backend=NativeBackend.name,
+            )
+            elapsed = time.monotonic() - st
+        finally:
+            os.chdir(cwd)
+        archives = [x for x in os.listdir(output_folder) if x.endswith(".bsa")]
+        packed = 0
+        for archive in archives:
+            with bsa.BSAReader(os.path.join(output_folder, archive)) as reader:
+                packed += len(reader)
+                if "textures\\foo.dds" in reader and bytes(reader.read("textures\\foo.dds")) != b"foo":
+                    sys.exit("! textures\\foo.dds has the wrong data")
+        if packed != files_count:
+            sys.exit(f"! {packed} files have been packed instead of {files_count}")
+        print(
+            f"* Packed {files_count} files ({total_size / 1024 / 1024:.0f} MB) in {len(archives)} archives, "
+            f"{elapsed:.2f} s, {total_size / 1024 / 1024 / elapsed:.0f} MB/s"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -0,0 +1,86 @@
+"""
+Compares the pipelined mode (--pipeline) with the regular one on a synthetic Data folder (see benchmarks.generator),
+with the native backend: time until the first archive is ready, and total time.
+It also checks that both modes create the same archives.
+
+The generated folder is in the OS cache, so it's scanned much faster than a real Data folder on a cold disk
+or on a network share, and there would be little scanning to overlap with packing. Each folder listing waits
+for a fixed latency first, to simulate that (0 to measure the folder as it is).
+
+Usage: python -m benchmarks.pipeline [files count] [max block size in MB] [workers] [listing latency in ms]
+"""
+import filecmp
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+import pigroman
+from benchmarks.generator import generate_data_tree
+from utils.metrics import Metrics
+from utils.scanner import Scanner
+
+
+@contextmanager
+def listing_latency(seconds: float) -> Iterator[None]:
+    """
+    Makes each folder listing of the Scanner wait for some time first
+
+    :param seconds: latency of each listing
+    """
+    list_dir = Scanner.list_dir
+
+    def slow_list_dir(path: str):
+        time.sleep(seconds)
+        return list_dir(path)
+
+    Scanner.list_dir = staticmethod(slow_list_dir)
+    try:
+        yield
+    finally:
+        Scanner.list_dir = staticmethod(list_dir)
+
+
+def main(files_count: int = 20000, max_block_size_mb: int = 64, workers: int = 2, latency_ms: int = 5) -> None:
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = generate_data_tree(tmp, files_count)
+        print(f"* {tree.files_count} files ({tree.total_size / 1024 / 1024:.0f} MB)")
+        data_path = tree.data_path
+        output_folders = {}
+        os.chdir(tmp)
+        try:
+            for pipelined in (False, True):
+                output_folder = os.path.join(tmp, "pipelined" if pipelined else "regular")
+                os.makedirs(output_folder)
+                output_folders[pipelined] = output_folder
+                metrics = Metrics()
+                with listing_latency(latency_ms / 1000):
+                    pigroman.main(
+                        data_path=data_path, folders_to_pack=list(tree.folders), output_folder=output_folder,
+                        output_name="bench", archive_tool_path="", max_block_size=max_block_size_mb * 1024 * 1024,
+                        create_esl=False, max_workers=workers, backend="native", metrics=metrics, pipelined=pipelined
+                    )
+                total = next(x for x in metrics.phases if x.name == "total")
+                scan = next(x for x in metrics.phases if x.name == "scan")
+                first = min(x.started + x.seconds for x in metrics.phases if x.name.startswith("block"))
+                print(
+                    f"* {'pipelined' if pipelined else 'regular':<9} scan {scan.seconds:.2f} s, "
+                    f"first archive after {first - total.started:.2f} s, total {total.seconds:.2f} s"
+                )
+        finally:
+            os.chdir(cwd)
+
+        archives = sorted(os.listdir(output_folders[False]))
+        if archives != sorted(os.listdir(output_folders[True])) or any(
+            not filecmp.cmp(os.path.join(output_folders[False], x), os.path.join(output_folders[True], x), False)
+            for x in archives
+        ):
+            sys.exit("! The archives are different")
+        print(f"* Same {len(archives)} archives in both modes")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
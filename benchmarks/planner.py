@@ -0,0 +1,47 @@
+"""
+Runs every block planner on a synthetic list of files and reports
+planning time, number of archives and fill efficiency.
+
+Usage: python -m benchmarks.planner [files count] [max block size in MB]
+"""
+import os
+import random
+import sys
+import time
+
+from utils.files import File
+from utils.planner import PLANNERS, fill_efficiency, folder_records, get_planner
+
+
+def main(files_count: int = 1000000, max_block_size_mb: int = 700) -> None:
+    rng = random.Random(0)
+    max_block_size = max_block_size_mb * 1024 * 1024
+    files = [
+        File(
+            os.path.join(os.sep, "data", "textures", f"folder{i // 200}", f"file{i}.dds"),
+            os.path.join(os.sep, "data"),
+            # Mostly small files, with a few big ones
+            size=int(rng.lognormvariate(11, 2)) % (max_block_size // 2)
+        )
+        for i in range(files_count)
+    ]
+    total = sum(x.size for x in files)
+    print(f"* {files_count} files, {total / 1024 / 1024 / 1024:.2f} GB, max block size {max_block_size_mb} MB")
+    for name in PLANNERS:
+        if name == "stable":
+            # The stable planner needs an output folder, and behaves like greedy on the first run
+            continue
+        planner = get_planner(name, max_block_size, output_folder="")
+        st = time.monotonic()
+        blocks = planner.plan(files)
+        elapsed = time.monotonic() - st
+        biggest = max(sum(files[x].size for x in block) for block in blocks)
+        print(
+            f"* {name:<10} {elapsed:.2f} s, {len(blocks)} archives, "
+            f"{fill_efficiency(blocks, files, max_block_size) * 100:.1f}% fill efficiency, "
+            f"{folder_records(blocks, files)} folder records, biggest archive {biggest / max_block_size * 100:.1f}% of max size"
+        )
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
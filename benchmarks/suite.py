@@ -0,0 +1,235 @@
+"""
+End-to-end benchmark. Generates a synthetic Data folder (see benchmarks.generator)
+and times each phase of pigroman on it: scan, hash/dedup, block planning, files lists,
+native packer and Archive.exe backend (with a stand-in Archive.exe, see benchmarks.archive_exe_stub).
+Results are written as JSON, and can be compared with the results of another run (eg: of another commit).
+
+Usage: python -m benchmarks.suite --help
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, Optional
+
+import bsa
+import pigroman
+from benchmarks import archive_exe_stub
+from benchmarks.generator import generate_data_tree
+from utils import conversions
+from utils.backends import ArchiveExeBackend
+from utils.dedup import TieredDeduplicator
+from utils.planner import PLANNERS, get_planner
+from utils.scanner import Scanner
+
+
+def git_commit() -> Optional[str]:
+    """
+    :return: hash of the current commit, or None if it's not available
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timed(phases: Dict[str, Dict[str, float]], name: str, func: Callable[[], Any], files: int, size: int) -> Any:
+    """
+    Runs a phase, and stores its timing and throughput in phases
+
+    :param phases: phase name -> results
+    :param name: name of the phase
+    :param func: function that runs the phase
+    :param files: number of files processed by the phase
+    :param size: number of bytes processed by the phase
+    :return: the return value of func
+    """
+    print(f"* {name}...")
+    st = time.monotonic()
+    r = func()
+    elapsed = time.monotonic() - st
+    phases[name] = {
+        "seconds": elapsed,
+        "files": files,
+        "bytes": size,
+        "files_per_second": files / elapsed if elapsed > 0 else 0.0,
+        "bytes_per_second": size / elapsed if elapsed > 0 else 0.0,
+    }
+    print(f"* {name}: {elapsed:.2f} s")
+    return r
+
+
+def pack_native(data_path: str, lists_folder: str, output_folder: str, blocks_count: int, compress: bool,
+                workers: int) -> None:
+    """
+    Packs the files lists in lists_folder with BSAArchive, in this process
+    """
+    for i in range(blocks_count):
+        archive = bsa.BSAArchive(
+            data_path,
+            archive_flags=bsa.ArchiveFlags.BETHESDA_DEFAULTS | (bsa.ArchiveFlags.COMPRESSED_ARCHIVE if compress else 0)
+        )
+        with open(os.path.join(lists_folder, f"out_{i}.txt"), "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    archive.add_file(os.path.join(archive.base_dir, line.replace("\\", os.sep)))
+        with open(os.path.join(output_folder, f"native{i}.bsa"), "wb") as f:
+            archive.write(f, workers=workers)
+
+
+def run(
+    files_count: int = 2000, depth: int = 3, duplicate_ratio: float = 0.1, size_scale: float = 0.25,
+    max_block_size: int = 64 * 1024 * 1024, planner: str = "greedy", compress: bool = False,
+    aggregate_duplicates: bool = True, scan_threads: int = 4, workers: int = 1, seed: int = 0
+) -> Dict[str, Any]:
+    """
+    Generates a synthetic Data folder in a temporary folder and times each phase on it
+
+    :return: the results, as a JSON-serializable dict
+    """
+    parameters = dict(locals())
+    phases: Dict[str, Dict[str, float]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = timed(
+            phases, "generate",
+            lambda: generate_data_tree(tmp, files_count, depth, duplicate_ratio, size_scale, seed=seed),
+            files_count, 0
+        )
+        print(
+            f"* {tree.files_count} files ({tree.total_size / 1024 / 1024:.0f} MB), "
+            f"{tree.duplicates_count} duplicates ({tree.duplicates_size / 1024 / 1024:.0f} MB)"
+        )
+        data_path = tree.data_path
+        output_folder = os.path.join(tmp, "out")
+        os.makedirs(output_folder)
+
+        scanner = Scanner(data_path, max_workers=scan_threads)
+        files = timed(
+            phases, "scan",
+            lambda: list(scanner.scan([os.path.join(data_path, x) for x in tree.folders])),
+            tree.files_count, tree.total_size
+        )
+
+        deduplicator = TieredDeduplicator()
+        duplicates = timed(phases, "hash", lambda: deduplicator.find(files), tree.files_count, tree.total_size)
+        phases["hash"]["bytes_read"] = deduplicator.bytes_read
+
+        blocks = timed(
+            phases, "plan",
+            lambda: get_planner(planner, max_block_size, output_folder).plan(files),
+            tree.files_count, tree.total_size
+        )
+        timed(
+            phases, "lists",
+            lambda: pigroman.write_files_lists(files, blocks, duplicates, aggregate_duplicates, folder=tmp),
+            tree.files_count, 0
+        )
+        timed(
+            phases, "native",
+            lambda: pack_native(data_path, tmp, output_folder, len(blocks), compress, workers),
+            tree.files_count, tree.total_size
+        )
+
+        if os.name == "nt":
+            print("! Skipping the Archive.exe backend, the Archive.exe stub cannot run on Windows")
+        else:
+            tool_folder = os.path.join(tmp, "archive")
+            os.makedirs(tool_folder)
+            archive_exe_stub.install(tool_folder)
+            packer = ArchiveExeBackend(
+                data_path=data_path, output_folder=output_folder, output_name="archive_exe", compress=compress,
+                archive_tool_path=tool_folder
+            )
+
+            def pack_archive_exe() -> None:
+                for i in range(len(blocks)):
+                    if packer.pack(i, os.path.join(tmp, f"out_{i}.txt")) != 0:
+                        raise RuntimeError(f"Archive.exe stub failed on block {i}")
+                packer.cleanup()
+
+            timed(phases, "archive.exe", pack_archive_exe, tree.files_count, tree.total_size)
+
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": parameters,
+        "tree": dict(tree._asdict()),
+        "blocks": len(blocks),
+        "phases": phases,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """
+    Prints the time of each phase in two runs
+
+    :param old: results of the previous run
+    :param new: results of this run
+    :return:
+    """
+    if old["parameters"] != new["parameters"]:
+        print("! The two runs have different parameters")
+    print(f"* {'phase':<12} {'old':>9} {'new':>9} {'change':>8}")
+    for name, phase in new["phases"].items():
+        if name not in old["phases"]:
+            continue
+        old_s = old["phases"][name]["seconds"]
+        new_s = phase["seconds"]
+        change = (new_s - old_s) / old_s * 100 if old_s > 0 else 0.0
+        print(f"* {name:<12} {old_s:>8.2f}s {new_s:>8.2f}s {change:>+7.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times each phase of pigroman on a synthetic Data folder")
+    parser.add_argument("-c", "--files-count", type=int, default=2000, help="Number of files. Default: 2000")
+    parser.add_argument("-d", "--depth", type=int, default=3, help="Depth of the folders. Default: 3")
+    parser.add_argument(
+        "-r", "--duplicate-ratio", type=float, default=0.1, help="Fraction of duplicate files. Default: 0.1"
+    )
+    parser.add_argument(
+        "-k", "--size-scale", type=float, default=0.25,
+        help="Multiplier of the median size of each file type. Default: 0.25"
+    )
+    parser.add_argument("-s", "--max-block-size", default="64M", help="Max size of each archive. Default: 64M")
+    parser.add_argument("-l", "--planner", choices=PLANNERS, default="greedy", help="Block planner. Default: greedy")
+    parser.add_argument("-z", "--compress", action="store_true", default=False, help="Compresses the archives")
+    parser.add_argument(
+        "--no-aggregate", action="store_true", default=False, help="Does not aggregate duplicates in the files lists"
+    )
+    parser.add_argument("-t", "--scan-threads", type=int, default=4, help="Scanner threads. Default: 4")
+    parser.add_argument("-p", "--parallel", type=int, default=1, help="Native packer processes. Default: 1")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument(
+        "-o", "--output", default="benchmark.json", help="JSON file with the results. Default: benchmark.json"
+    )
+    parser.add_argument(
+        "--compare", help="Compares the results with the ones in this JSON file", required=False
+    )
+    args = parser.parse_args()
+    results = run(
+        files_count=args.files_count,
+        depth=args.depth,
+        duplicate_ratio=args.duplicate_ratio,
+        size_scale=args.size_scale,
+        max_block_size=conversions.readable_size_to_number(args.max_block_size),
+        planner=args.planner,
+        compress=args.compress,
+        aggregate_duplicates=not args.no_aggregate,
+        scan_threads=args.scan_threads,
+        workers=args.parallel,
+        seed=args.seed,
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"* Results written to {args.output}")
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
@@ -0,0 +1,48 @@
+"""
+Writes the same uncompressed archive with and without zero-copy
+(os.copy_file_range / os.sendfile) and reports the speedup.
+
+Usage: python -m benchmarks.zero_copy [total size in MB] [files count]
+"""
+import os
+import sys
+import tempfile
+
+import bsa
+
+
+def main(total_size_mb: int = 2048, files_count: int = 128) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = os.path.join(tmp, "data")
+        folder = os.path.join(data_path, "textures")
+        os.makedirs(folder)
+        file_size = total_size_mb * 1024 * 1024 // files_count
+        paths = []
+        chunk = os.urandom(1024 * 1024)
+        for i in range(files_count):
+            path = os.path.join(folder, f"file{i}.dds")
+            with open(path, "wb") as f:
+                for _ in range(file_size // len(chunk)):
+                    f.write(chunk)
+                f.write(chunk[:file_size % len(chunk)])
+            paths.append(path)
+
+        times = {}
+        for zero_copy in (False, True):
+            bsa.ZERO_COPY = zero_copy
+            archive = bsa.BSAArchive(data_path)
+            archive.add_files(*paths)
+            out_path = os.path.join(tmp, "out.bsa")
+            with open(out_path, "wb") as f:
+                archive.write(f)
+            os.remove(out_path)
+            times[zero_copy] = archive.data_write_time
+            print(
+                f"* {'zero-copy' if zero_copy else 'buffered':<10} {archive.data_write_time:.2f} s, "
+                f"{archive.raw_data_size / 1024 / 1024 / archive.data_write_time:.0f} MB/s"
+            )
+        print(f"* Speedup: {times[False] / times[True]:.2f}x")
+
+
+if __name__ == "__main__":
+    main(*(int(x) for x in sys.argv[1:]))
@@ -1,17 +1,30 @@
 """
-An attempt at making a Python BSA packer.
-I ended up using Archive.exe because I ran out of time.
-You can safely delete this file if you want.
+A Python BSA packer, used by the native backend (pigroman.py -b native).
+Can also be used on its own: python bsa.py --help
 """
-import functools
-import bisect
+import errno
+import filecmp
+import mmap
 import os
+import sys
+import tempfile
+import time
+import zlib
 from abc import ABC
+from array import array
+from bisect import bisect_left
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from enum import Enum, IntFlag, auto
-from struct import pack
-from typing import Set, IO, List
+from itertools import repeat
+from operator import attrgetter
+from struct import pack, unpack_from
+from typing import Deque, Dict, Iterator, Optional, Set, IO, List, Tuple, Union
 
-from cached_property import cached_property
+import lz4.frame
+
+from utils.hashing import file_hash
 
 
 class Game(Enum):
@@ -19,6 +32,13 @@ class Game(Enum):
     SKYRIM_SE = 0x69
 
 
+# Size, in bytes, of a folder record
+FOLDER_RECORD_SIZE = {
+    Game.SKYRIM_LE: 16,
+    Game.SKYRIM_SE: 24,
+}
+
+
 class ArchiveFlags(IntFlag):
     INCLUDE_DIRECTORY_NAMES = 0x1
     INCLUDE_FILE_NAMES = 0x2
@@ -63,131 +83,301 @@ FILE_FLAGS_EXTENSIONS_MAPPING = {
 }
 
 
-@functools.total_ordering
-class BSAEntry:
-    def __init__(self, file_path: str, archive: "BSAArchive"):
-        self.file_path = file_path.strip().lower()
-        if not self.file_path.startswith(archive.base_dir):
-            raise ValueError("The file must be in the base bsa directory")
-        self.local_file_path = self.file_path[len(archive.base_dir):].lstrip("\\").strip()
-
-    @property
-    def folder_name(self) -> str:
-        return "\\".join(self.local_file_path.split("\\")[:-1])
-
-    @property
-    def file_name(self) -> str:
-        return self.local_file_path.split("\\")[-1]
-
-    @cached_property
-    def folder_hash(self) -> int:
-        return BSAArchive.tes_hash(self.folder_name)
+def compress_file(path: str, game: Game, chunk_size: int = 1024 * 1024) -> bytes:
+    """
+    Compresses a file, as it must be stored in a compressed archive:
+    original size (uint32) followed by a LZ4 frame (Skyrim SE) or a zlib stream (Skyrim LE).
+    The file is read in chunks, so only the compressed data is held in memory.
+    This is a module-level function so it can run in a process pool.
+
+    :param path: path of the file to compress
+    :param game: game the archive is for
+    :param chunk_size: size, in bytes, of each read
+    :return: the compressed data block
+    """
+    size = os.path.getsize(path)
+    chunks = [pack("<L", size)]
+    if game == Game.SKYRIM_SE:
+        compressor = lz4.frame.LZ4FrameCompressor()
+        chunks.append(compressor.begin(source_size=size))
+    else:
+        compressor = zlib.compressobj()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            chunks.append(compressor.compress(data))
+    chunks.append(compressor.flush())
+    return b"".join(chunks)
+
+
+def copy_stream(src: IO, dst: IO, size: int, chunk_size: int = 1024 * 1024) -> int:
+    """
+    Copies `size` bytes from a stream to another one, in chunks
+
+    :param src: source stream
+    :param dst: destination stream
+    :param size: number of bytes to copy
+    :param chunk_size: max size, in bytes, of each read
+    :return: number of copied bytes
+    """
+    copied = 0
+    while copied < size:
+        data = src.read(min(chunk_size, size - copied))
+        if not data:
+            break
+        copied += dst.write(data)
+    return copied
+
+
+# If True, file data is copied with os.copy_file_range or os.sendfile when possible
+ZERO_COPY = True
+
+
+class _ZeroCopyUnsupported(Exception):
+    pass
+
+
+def _copy_file_range(src_fd: int, src_offset: int, dst_fd: int, size: int) -> int:
+    copied = 0
+    while copied < size:
+        try:
+            n = os.copy_file_range(src_fd, dst_fd, size - copied, src_offset + copied)
+        except OSError as e:
+            if copied == 0 and e.errno in (errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF):
+                raise _ZeroCopyUnsupported()
+            raise
+        if n == 0:
+            if copied == 0:
+                # Some file systems (procfs, some FUSE and overlay mounts) return 0 instead of failing
+                raise _ZeroCopyUnsupported()
+            break
+        copied += n
+    return copied
+
+
+def _sendfile(src_fd: int, src_offset: int, dst_fd: int, size: int) -> int:
+    copied = 0
+    while copied < size:
+        try:
+            n = os.sendfile(dst_fd, src_fd, src_offset + copied, size - copied)
+        except OSError as e:
+            if copied == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.EBADF):
+                raise _ZeroCopyUnsupported()
+            raise
+        if n == 0:
+            if copied == 0:
+                # Some file systems (procfs, some FUSE and overlay mounts) return 0 instead of failing
+                raise _ZeroCopyUnsupported()
+            break
+        copied += n
+    return copied
+
+
+# Zero-copy functions available on this platform, in order of preference
+_ZERO_COPY_FUNCTIONS = tuple(
+    f for name, f in (("copy_file_range", _copy_file_range), ("sendfile", _sendfile)) if hasattr(os, name)
+)
+
+
+def copy_file_data(src: IO, src_offset: int, dst: IO, size: int) -> int:
+    """
+    Copies `size` bytes of a file, starting from `src_offset`, to the current position of a stream.
+    If the destination has a file descriptor, the data is copied by the kernel with
+    os.copy_file_range (which can reflink on btrfs/XFS) or os.sendfile, so it never goes
+    through user space. Otherwise, or if neither works, it falls back to a buffered copy.
+
+    :param src: source file, opened in binary mode
+    :param src_offset: offset of the first byte to copy
+    :param dst: destination stream
+    :param size: number of bytes to copy
+    :return: number of copied bytes
+    """
+    if ZERO_COPY and _ZERO_COPY_FUNCTIONS:
+        try:
+            dst_fd = dst.fileno()
+        except (AttributeError, OSError):
+            dst_fd = None
+        if dst_fd is not None:
+            # Write whatever is buffered before writing to the file descriptor
+            dst.flush()
+            for zero_copy in _ZERO_COPY_FUNCTIONS:
+                try:
+                    return zero_copy(src.fileno(), src_offset, dst_fd, size)
+                except _ZeroCopyUnsupported:
+                    continue
+    src.seek(src_offset)
+    return copy_stream(src, dst, size)
 
-    @cached_property
-    def file_hash(self) -> int:
-        return BSAArchive.tes_hash(*self.file_name.split("."))
 
-    def __eq__(self, other: "BSAEntry") -> bool:
-        return self.folder_hash == other.folder_hash and self.file_hash == other.file_hash
-
-    def __ne__(self, other: "BSAEntry") -> bool:
-        return not (self == other)
-
-    def __lt__(self, other: "BSAEntry") -> bool:
-        if self.folder_hash == other.folder_hash:
-            return self.file_hash < other.file_hash
-        return self.folder_hash < other.folder_hash
+class BSAEntry:
+    """
+    A file that will be added to an archive, with its precomputed sort key
+    """
+
+    __slots__ = ("file_path", "local_file_path", "folder_name", "file_name", "folder_hash", "file_hash")
+
+    def __init__(self, file_path: str, archive: "BSAArchive", folder_hashes: Optional[Dict[str, int]] = None):
+        """
+        :param file_path: absolute path of the file, as it is on disk
+        :param archive: archive the file will be added to
+        :param folder_hashes: folder name -> hash dictionary, shared by all entries of an archive,
+                              so each folder is hashed only once
+        """
+        self.file_path = file_path.strip()
+        if not os.path.normcase(self.file_path).startswith(os.path.normcase(archive.base_dir)):
+            raise ValueError("The file must be in the base bsa directory")
+        # Paths inside the archive are always lower case, with backslashes. The path on disk keeps its case.
+        self.local_file_path = self.file_path[len(archive.base_dir):].lstrip(os.sep).strip().replace(
+            os.sep, "\\"
+        ).lower()
+        self.folder_name, _, self.file_name = self.local_file_path.rpartition("\\")
+        if folder_hashes is None:
+            folder_hashes = {}
+        folder_hash = folder_hashes.get(self.folder_name)
+        if folder_hash is None:
+            folder_hash = folder_hashes[self.folder_name] = BSAArchive.tes_hash(self.folder_name)
+        self.folder_hash = folder_hash
+        self.file_hash = BSAArchive.tes_file_hash(self.file_name)
 
 
 class TESHashable(ABC):
-    def __init__(self, value: str):
+    __slots__ = ("value", "hash")
+
+    def __init__(self, value: str, hash_: Optional[int] = None):
+        """
+        :param value: string to hash
+        :param hash_: precomputed hash of `value`. If None, it's computed now.
+        """
         self.value = value
+        self.hash = hash_ if hash_ is not None else self.compute_hash()
 
-    @cached_property
-    def hash(self) -> int:
+    def compute_hash(self) -> int:
         return BSAArchive.tes_hash(self.value)
 
 
 class BSAFile(TESHashable):
     INVERT_COMPRESS = 0x40000000
+    # Files up to this size are never compressed
+    COMPRESS_THRESHOLD = 32
     CHUNK_SIZE = 1024 * 1024
 
-    def __init__(self, path: str, offset: int):
+    __slots__ = ("path", "bsa_path", "offset", "size", "stored_size", "shared")
+
+    def __init__(
+        self, path: str, bsa_path: str, offset: int, size: Optional[int] = None, hash_: Optional[int] = None
+    ):
+        """
+        :param path: absolute path of the file on disk
+        :param bsa_path: path of the file inside the archive (folder\\file name)
+        :param offset: offset of the file's data from the beginning of the archive
+        :param size: size of the file on disk. If None, it's read from the file system.
+        :param hash_: precomputed hash of the file name
+        """
         self.path = path
-        self.bsa_path = path     # TODO: Fix and check for other memes, we don't want C:\ etc inside BSAs...
-        super(BSAFile, self).__init__(self.file_name)
+        self.bsa_path = bsa_path
+        super(BSAFile, self).__init__(self.file_name, hash_)
         self.offset = offset
+        self.size = size if size is not None else os.path.getsize(path)
+        # Size of the data block in the archive. Known after the data has been written.
+        self.stored_size: Optional[int] = None
+        # File with the same content, whose data block is shared with this file
+        self.shared: Optional[BSAFile] = None
 
     @property
     def should_compress(self) -> bool:
-        return self.size > 32
+        return self.size > BSAFile.COMPRESS_THRESHOLD
 
-    @cached_property
-    def size(self) -> int:
-        return os.path.getsize(self.path)
+    def is_compressed(self, archive_flags: ArchiveFlags) -> bool:
+        return self.should_compress and (archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) > 0
 
     def size_with_flag(self, archive_flags: ArchiveFlags):
-        r = self.size
-        if (archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) > 0 != self.should_compress:
+        r = self.stored_size if self.stored_size is not None else self.size
+        if ((archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) > 0) != self.is_compressed(archive_flags):
             r |= BSAFile.INVERT_COMPRESS
         return r
 
     @property
     def file_name(self) -> str:
-        return self.path.split("\\")[-1]
+        return self.bsa_path.split("\\")[-1]
 
-    @cached_property
-    def hash(self) -> int:
-        return BSAArchive.tes_hash(*self.value.split("."))
+    def compute_hash(self) -> int:
+        return BSAArchive.tes_file_hash(self.value)
 
     def block(self, archive_flags: ArchiveFlags) -> bytes:
         return pack("<QLL", self.hash, self.size_with_flag(archive_flags), self.offset)
 
+    def embedded_name(self, archive_flags: ArchiveFlags) -> bytes:
+        """
+        Returns the name that prefixes the file's data, if the archive embeds file names
+
+        :param archive_flags: flags of the archive
+        :return: a bstring with the file's path inside the archive, or b"" if file names are not embedded
+        """
+        if (archive_flags & ArchiveFlags.EMBED_FILE_NAMES) > 0:
+            return bytes(BSAString(self.bsa_path, zero_terminated=False))
+        return b""
+
     def _write_uncompressed_data_block(self, out: IO) -> int:
-        size = 0
         with open(self.path, "rb") as f:
-            while True:
-                f_data = f.read(BSAFile.CHUNK_SIZE)
-                if not f_data:
-                    break
-                size += out.write(f_data)
+            # Exactly self.size bytes are copied, so a file that grew would be silently truncated
+            if os.fstat(f.fileno()).st_size != self.size:
+                raise RuntimeError(f"{self.path} has changed while the archive was being written")
+            return copy_file_data(f, 0, out, self.size)
+
+    def _write_compressed_data_block(self, out: IO, spool: IO, spool_offset: int, size: int) -> int:
+        return copy_file_data(spool, spool_offset, out, size)
+
+    def write_data_block(
+        self, out: IO, archive_flags: ArchiveFlags, spool: Optional[IO] = None, spool_offset: int = 0
+    ) -> int:
+        """
+        Writes this file's data block. stored_size must have been set already.
+
+        :param out: output stream
+        :param archive_flags: flags of the archive
+        :param spool: file containing the compressed data of this file
+                      (see BSAArchive._compute_stored_sizes). Used only if this file is compressed.
+        :param spool_offset: offset of this file's compressed data in `spool`
+        :return: number of written bytes
+        """
+        size = out.write(self.embedded_name(archive_flags))
+        if self.is_compressed(archive_flags):
+            size += self._write_compressed_data_block(out, spool, spool_offset, self.stored_size - size)
+        else:
+            size += self._write_uncompressed_data_block(out)
+        if size != self.stored_size:
+            raise RuntimeError(f"{self.path} has changed while the archive was being written")
         return size
 
-    def _write_compressed_data_block(self, out: IO) -> int:
-        # TODO: https://python-lz4.readthedocs.io/en/stable/quickstart.html#working-with-data-in-chunks
-        # with open(self.path, "rb") as f:
-        #     while True:
-        #         f_data = f.read(BSAFile.CHUNK_SIZE)
-        #         if not f_data:
-        #             break
-        #         out.write(f_data)
-        raise NotImplementedError()
-
-    def write_data_block(self, out: IO, archive_flags: ArchiveFlags) -> int:
-        if (archive_flags & ArchiveFlags.INCLUDE_FILE_NAMES) > 0:
-            out.write(self.bsa_path.encode())
-        if self.should_compress and (archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) > 0:
-            return self._write_compressed_data_block(out)
-        return self._write_uncompressed_data_block(out)
-
 
 class BSAString:
-    def __init__(self, value: str):
+    __slots__ = ("value", "zero_terminated")
+
+    def __init__(self, value: str, zero_terminated: bool = True):
         self.value = value
+        self.zero_terminated = zero_terminated
 
     def __bytes__(self) -> bytes:
-        r = bytearray(pack("<B", len(self.value)))
+        r = bytearray(pack("<B", len(self.value) + int(self.zero_terminated)))
         r.extend(self.value.encode())
+        if self.zero_terminated:
+            r.append(0)
         return bytes(r)
 
 
 class BSAFolder(TESHashable):
-    def __init__(self, name: str, offset: int = 0):
-        super(BSAFolder, self).__init__(name)
+    __slots__ = ("files", "offset")
+
+    def __init__(self, name: str, offset: int = 0, hash_: Optional[int] = None):
+        super(BSAFolder, self).__init__(name, hash_)
         self.files: List[BSAFile] = []
         self.offset = offset
 
-    def block(self) -> bytes:
+    def block(self, game: Game = Game.SKYRIM_SE) -> bytes:
+        if game == Game.SKYRIM_LE:
+            return pack("<QLL", self.hash, len(self.files), self.offset)
         return pack("<QLLq", self.hash, len(self.files), 0, self.offset)
 
 
@@ -201,9 +391,9 @@ class BSAArchive:
         auto_file_flags: bool = True
     ):
         self.game = game
-        self.base_dir = base_dir.strip().lower()
-        if not self.base_dir.endswith("\\"):
-            self.base_dir += "\\"
+        self.base_dir = base_dir.strip()
+        if not self.base_dir.endswith(os.sep):
+            self.base_dir += os.sep
         self.archive_flags = archive_flags
         self.auto_file_flags = auto_file_flags
         self.file_flags = file_flags
@@ -215,6 +405,15 @@ class BSAArchive:
         self.folder_names_length = 0
         self.file_names_length = 0
 
+        # Stats of the last write
+        self.header_write_time = 0.0
+        self.raw_data_size = 0
+        self.stored_data_size = 0
+        self.shared_files_count = 0
+        self.shared_data_size = 0
+        self.data_write_time = 0.0
+        self.workers = 1
+
     # def add_files(self, *files: str):
     #     for file_path in files:
     #         file_path = file_path.lower().strip()
@@ -226,16 +425,15 @@ class BSAArchive:
     #         self.files.add(file_path)
 
     def add_file(self, file_path: str) -> None:
-        if "/" in file_path:
+        if os.sep == "\\" and "/" in file_path:
             raise ValueError("The file_path must not contain '/'. Please replace it with '\\'.")
-        file_path = file_path.lower().strip()
-        if not file_path.startswith(self.base_dir):
+        file_path = file_path.strip()
+        if not os.path.normcase(file_path).startswith(os.path.normcase(self.base_dir)):
             raise ValueError("The file must be in the base directory")
         if self.auto_file_flags:
-            for k, v in FILE_FLAGS_EXTENSIONS_MAPPING.items():
-                if file_path.endswith(k):
-                    self.file_flags |= v
-                    break
+            self.file_flags |= FILE_FLAGS_EXTENSIONS_MAPPING.get(
+                os.path.splitext(file_path)[1].lower(), FileFlags.NONE
+            )
         self.files.add(file_path)
 
     def add_files(self, *files: str) -> None:
@@ -244,11 +442,12 @@ class BSAArchive:
 
     @staticmethod
     def tes_hash(file_name: str, extension: str = "") -> int:
-        print(f"HASH: {file_name} ~ {extension}")
         if extension and not extension.startswith("."):
             extension = f".{extension}"
         chars = [ord(x) for x in file_name]
-        hash1 = chars[-1] | (0, chars[-2])[len(chars) > 2] << 8 | len(chars) << 16 | chars[0] << 24
+        if not chars:
+            return 0
+        hash1 = chars[-1] | (chars[-2] if len(chars) > 2 else 0) << 8 | len(chars) << 16 | chars[0] << 24
         if extension == ".kf":
             hash1 |= 0x80
         elif extension == ".nif":
@@ -265,35 +464,168 @@ class BSAArchive:
         hash2 = (hash2 + hash3) & uint_mask
         return (hash2 << 32) + hash1
 
-    def write(self, out: IO) -> None:
-        if not self.files:
-            raise RuntimeError("No files have been added to the archive.")
+    def _compress_files(self, file_records: List[BSAFile], workers: int) -> Iterator[Optional[bytes]]:
+        """
+        Compresses the files that must be compressed, in order.
+        With more than one worker, the files are compressed in a process pool. Only a few
+        files ahead of the one being written are compressed at any time, so the compressed
+        data of the whole archive is never held in memory.
+
+        :param file_records: files, in the order they will be written
+        :param workers: number of worker processes
+        :return: compressed data for each file, or None for the files that must not be compressed
+        """
+        if workers <= 1:
+            for file_record in file_records:
+                if file_record.is_compressed(self.archive_flags):
+                    yield compress_file(file_record.path, self.game, BSAFile.CHUNK_SIZE)
+                else:
+                    yield None
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            pending: Deque = deque()
+            for file_record in file_records:
+                pending.append(
+                    executor.submit(compress_file, file_record.path, self.game, BSAFile.CHUNK_SIZE)
+                    if file_record.is_compressed(self.archive_flags) else None
+                )
+                if len(pending) > workers * 4:
+                    future = pending.popleft()
+                    yield future.result() if future is not None else None
+            while pending:
+                future = pending.popleft()
+                yield future.result() if future is not None else None
 
-        # TODO: Remove this crap
-        files: List[BSAEntry] = []
-        for file_path in self.files:
-            bisect.insort(files, BSAEntry(file_path, self))
+    @staticmethod
+    def tes_file_hash(file_name: str) -> int:
+        """
+        Hashes a file name. The extension (from the last dot) is hashed separately.
+
+        :param file_name: file name, with extension
+        :return: hash of the file name
+        """
+        name, extension = os.path.splitext(file_name)
+        return BSAArchive.tes_hash(name, extension)
+
+    def _index(self) -> List[BSAFolder]:
+        """
+        Sorts the files by (folder hash, file hash), in a single pass, and groups them in folder records.
+        Also sets the folders/files count and names length.
+
+        :return: folder records, in the order they must be written
+        """
+        folder_hashes: Dict[str, int] = {}
+        entries = [BSAEntry(file_path, self, folder_hashes) for file_path in self.files]
+        entries.sort(key=attrgetter("folder_hash", "file_hash"))
 
         self.folder_names_length = 0
         self.file_names_length = 0
-
+        folder_records: List[BSAFolder] = []
         last_folder_hash = None
-        self.folders_count = 0
-        self.files_count = 0
-        folder_records = []
-        # file_records = []
-        for file in files:
-            if last_folder_hash != file.folder_hash:
-                self.folders_count += 1
-                last_folder_hash = file.folder_hash
-                folder_records.append(BSAFolder(file.folder_name))
+        for entry in entries:
+            if last_folder_hash != entry.folder_hash:
+                last_folder_hash = entry.folder_hash
+                folder_records.append(BSAFolder(entry.folder_name, hash_=entry.folder_hash))
                 # \x00 terminator => +1
-                self.folder_names_length += len(file.folder_name) + 1
+                self.folder_names_length += len(entry.folder_name) + 1
             # the 0 (offset) gets filled later
-            folder_records[-1].files.append(BSAFile(file.file_path, offset=0))
-            # file_records.append(f_record)
-            self.files_count += 1
-            self.file_names_length += len(file.file_name) + 1
+            folder_records[-1].files.append(
+                BSAFile(entry.file_path, bsa_path=entry.local_file_path, offset=0, hash_=entry.file_hash)
+            )
+            self.file_names_length += len(entry.file_name) + 1
+        self.folders_count = len(folder_records)
+        self.files_count = len(entries)
+        return folder_records
+
+    def _file_records(self, folder_records: List[BSAFolder]) -> bytes:
+        """
+        Returns the file record blocks (folder name followed by the folder's file records)
+
+        :param folder_records: folder records
+        :return: file record blocks
+        """
+        r = bytearray()
+        for folder_record in folder_records:
+            r += bytes(BSAString(folder_record.value))
+            for file_record in folder_record.files:
+                r += file_record.block(self.archive_flags)
+        return bytes(r)
+
+    def _find_shared_data(self, file_records: List[BSAFile]) -> None:
+        """
+        Finds the files with the same content, and makes them share the data block of the first one (see
+        BSAFile.shared). Only files with the same size are hashed, and files with the same hash are compared
+        byte by byte before sharing their data. Does nothing if share_data is False, or if file names are
+        embedded in the data blocks, as each data block would start with a different name.
+
+        :param file_records: files, in the order they will be written
+        :return:
+        """
+        for file_record in file_records:
+            file_record.shared = None
+        if not self.share_data or (self.archive_flags & ArchiveFlags.EMBED_FILE_NAMES) > 0:
+            return
+        same_size: Dict[int, List[BSAFile]] = defaultdict(list)
+        for file_record in file_records:
+            same_size[file_record.size].append(file_record)
+        for candidates in same_size.values():
+            if len(candidates) < 2:
+                continue
+            # hash -> first file with that content
+            owners: Dict[int, BSAFile] = {}
+            for file_record in candidates:
+                owner = owners.setdefault(file_hash(file_record.path), file_record)
+                if owner is not file_record and filecmp.cmp(owner.path, file_record.path, shallow=False):
+                    file_record.shared = owner
+
+    def _compute_stored_sizes(self, file_records: List[BSAFile], spool: Optional[IO], workers: int) -> None:
+        """
+        Sets the stored size of every file, so the whole layout of the archive
+        is known before writing anything.
+        The size of uncompressed files is known already. Files that must be compressed
+        are compressed now, and their compressed data is written to `spool`, in order.
+
+        :param file_records: files, in the order they will be written
+        :param spool: temporary stream for the compressed data. Can be None if the archive is not compressed.
+        :param workers: number of processes used to compress the files
+        :return:
+        """
+        # Files that share the data of another file are not compressed again
+        unique_records = [x for x in file_records if x.shared is None]
+        compressed = (
+            self._compress_files(unique_records, workers)
+            if (self.archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) > 0
+            else repeat(None)
+        )
+        embed_names = (self.archive_flags & ArchiveFlags.EMBED_FILE_NAMES) > 0
+        for compressed_data, file_record in zip(compressed, unique_records):
+            size = 1 + len(file_record.bsa_path) if embed_names else 0
+            if compressed_data is not None:
+                size += spool.write(compressed_data)
+            else:
+                size += file_record.size
+            file_record.stored_size = size
+        for file_record in file_records:
+            if file_record.shared is not None:
+                file_record.stored_size = file_record.shared.stored_size
+
+    def write(self, out: IO, workers: int = 1) -> None:
+        """
+        Writes the archive in a single pass.
+        The output stream doesn't need to be seekable, so archives can be written to pipes and sockets.
+        Compressed archives are compressed to a temporary file first, as the size of each
+        compressed file must be known before writing the header.
+        If share_data is True, identical files are stored only once (see _find_shared_data).
+
+        :param out: output stream
+        :param workers: number of processes used to compress the files (compressed archives only)
+        :return:
+        """
+        if not self.files:
+            raise RuntimeError("No files have been added to the archive.")
+
+        st = time.monotonic()
+        folder_records = self._index()
 
         # Fix flags
         # SSE has no MISCELLANEOUS flag
@@ -312,12 +644,23 @@ class BSAArchive:
         # ALWAYS remove the dummy AUTO flag
         # self.file_flags &= ~FileFlags.AUTO
 
-        # Write header
-        offset = 0
-        out.seek(offset)
-        offset += out.write(bytearray(b"BSA\x00"))
-        offset += out.write(
-            pack(
+        file_records = [x for folder_record in folder_records for x in folder_record.files]
+        compressed_archive = (self.archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) > 0
+        with (tempfile.TemporaryFile() if compressed_archive else nullcontext()) as spool:
+            # Compress the files (if needed) to know their final size
+            data_st = time.monotonic()
+            self._find_shared_data(file_records)
+            self._compute_stored_sizes(file_records, spool, workers)
+            self.raw_data_size = sum(x.size for x in file_records)
+            self.stored_data_size = sum(x.stored_size for x in file_records if x.shared is None)
+            self.shared_files_count = sum(1 for x in file_records if x.shared is not None)
+            self.shared_data_size = sum(x.stored_size for x in file_records if x.shared is not None)
+            self.workers = workers
+            compression_time = time.monotonic() - data_st
+
+            # Build header, folder records, file records and file names in memory
+            header = bytearray(b"BSA\x00")
+            header += pack(
                 "<llllllll",
                 self.game.value,
                 36,
@@ -328,44 +671,348 @@ class BSAArchive:
                 self.file_names_length,
                 self.file_flags.value,
             )
-        )
 
-        # Calculate data offset
-        # 128 for SSE, 16 for non-SSE
-        data_offset = offset + 128 * len(folder_records) + self.file_names_length
+            # Calculate the offset of the file records
+            # The offset in the folder records is (offset of the folder's file records + total file names length)
+            data_offset = len(header) + FOLDER_RECORD_SIZE[self.game] * len(folder_records) + self.file_names_length
+
+            # Folder records
+            for record in folder_records:
+                record.offset = data_offset
+                data_offset += len(record.value) + 2    # + length prefix + terminator
+                data_offset += 16 * len(record.files)
+                header += record.block(self.game)
+
+            # The data section starts right after the file records and the file names
+            offset = data_offset - self.file_names_length
+            if (self.archive_flags & ArchiveFlags.INCLUDE_FILE_NAMES) > 0:
+                offset += self.file_names_length
+            for file_record in file_records:
+                if file_record.shared is not None:
+                    # The first file with the same content comes before this one
+                    file_record.offset = file_record.shared.offset
+                    continue
+                file_record.offset = offset
+                offset += file_record.stored_size
+            if offset > 0xFFFFFFFF:
+                raise ValueError("The archive is too big (max 4 GB)")
+
+            # File records
+            header += self._file_records(folder_records)
+
+            # File names, if necessary
+            if (self.archive_flags & ArchiveFlags.INCLUDE_FILE_NAMES) > 0:
+                header += b"".join(
+                    file_record.file_name.encode() + b"\x00"
+                    for folder_record in folder_records
+                    for file_record in folder_record.files
+                )
+            if len(header) != file_records[0].offset:
+                raise RuntimeError("Wrong archive layout")
+            out.write(header)
+            self.header_write_time = time.monotonic() - st - compression_time
+
+            # Write file data, in the same order as the file records
+            data_st = time.monotonic()
+            if spool is not None:
+                spool.flush()
+            spool_offset = 0
+            for file_record in file_records:
+                if file_record.shared is not None:
+                    continue
+                written = file_record.write_data_block(out, self.archive_flags, spool, spool_offset)
+                if file_record.is_compressed(self.archive_flags):
+                    spool_offset += written - len(file_record.embedded_name(self.archive_flags))
+            self.data_write_time = compression_time + time.monotonic() - data_st
+
+
+class BSAReader:
+    """
+    Reads an existing Skyrim SE/LE archive.
+
+    The archive is memory-mapped, and only the header, the folder records and the file records
+    are parsed, into arrays sorted by (folder hash, file hash), the same order they're stored in.
+    Finding a file by path is a binary search on the folder hashes, followed by a binary search
+    on that folder's file hashes. File names are only parsed if they're needed (paths()).
+    Data of uncompressed files is returned as memoryviews of the mapped file, without copying it.
+    """
+
+    def __init__(self, path: str):
+        """
+        Opens and indexes an archive
+
+        :param path: path of the archive
+        """
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            self._file.close()
+            raise ValueError(f"{path} is not a BSA archive")
+        self._view = memoryview(self._mmap)
+        try:
+            self._parse()
+        except Exception:
+            self.close()
+            raise
+
+    def _parse(self) -> None:
+        view = self._view
+        if len(view) < 36 or view[:4] != b"BSA\x00":
+            raise ValueError(f"{self.path} is not a BSA archive")
+        (
+            version, _, archive_flags, self.folders_count, self.files_count,
+            self.folder_names_length, self.file_names_length, file_flags
+        ) = unpack_from("<llllllll", view, 4)
+        self.game = Game(version)
+        self.archive_flags = ArchiveFlags(archive_flags)
+        self.file_flags = FileFlags(file_flags)
+
+        # Folder records: SSE = hash, count + padding, offset (3 uint64)
+        # LE = hash, count + offset << 32 (2 uint64)
+        record_size = FOLDER_RECORD_SIZE[self.game]
+        folder_records = self._uint64_array(36, record_size * self.folders_count)
+        stride = record_size // 8
+        self._folder_hashes = folder_records[0::stride]
+        self._folder_counts = array("Q", (x & 0xFFFFFFFF for x in folder_records[1::stride]))
+        if self.game == Game.SKYRIM_LE:
+            folder_offsets = [x >> 32 for x in folder_records[1::stride]]
+        else:
+            folder_offsets = folder_records[2::stride]
+
+        # File record blocks: folder name (bzstring) followed by the folder's file records.
+        # Each file record is hash (uint64), size | offset << 32 (uint64)
+        self._folder_names: List[int] = []
+        self._folder_first_file = array("Q")
+        file_records = array("Q")
+        end = 36 + record_size * self.folders_count
+        for offset, count in zip(folder_offsets, self._folder_counts):
+            position = offset - self.file_names_length
+            self._folder_names.append(position)
+            position += 1 + view[position]
+            self._folder_first_file.append(len(file_records) // 2)
+            file_records.extend(self._uint64_array(position, 16 * count))
+            end = position + 16 * count
+        self._file_hashes = file_records[0::2]
+        self._file_records = file_records[1::2]
+        self._file_names_offset = end
+
+    def _uint64_array(self, offset: int, size: int) -> array:
+        r = array("Q")
+        r.frombytes(self._view[offset:offset + size])
+        if sys.byteorder != "little":
+            r.byteswap()
+        return r
+
+    def close(self) -> None:
+        """
+        Closes the archive. All memoryviews returned by this reader must have been released.
+        """
+        self._view.release()
+        self._mmap.close()
+        self._file.close()
 
-        # Write folder records
-        for record in folder_records:
-            record.offset = data_offset
-            data_offset += len(record.value) + 2    # + length prefix + terminator
-            data_offset += 16 * len(record.files)
-            offset += out.write(record.block())
+    def __enter__(self) -> "BSAReader":
+        return self
 
-        # Write file records
-        file_records_base = offset
-        for folder_record in folder_records:
-            offset += out.write(bytes(BSAString(folder_record.value)))
-            for file_record in folder_record.files:
-                offset += out.write(file_record.block(self.archive_flags))
+    def __exit__(self, *_) -> None:
+        self.close()
 
-        # Write file names if necessary
-        if (self.archive_flags & ArchiveFlags.INCLUDE_FILE_NAMES) > 0:
-            for folder_record in folder_records:
-                for file_record in folder_record.files:
-                    offset += out.write(file_record.file_name.encode())
-                    offset += out.write(b"\x00")
+    def __len__(self) -> int:
+        return len(self._file_hashes)
 
-        # Write file data and set offest
-        for folder_record in folder_records:
-            for file_record in folder_record.files:
-                file_record.offset = offset
-                offset += file_record.write_data_block(out, self.archive_flags)
+    def __contains__(self, path: str) -> bool:
+        return self.find(path) is not None
 
-        # Re-write files section as we have file offsets now
-        # TODO: read and edit offset only, do not rewrite everything
-        offset = file_records_base
-        out.seek(offset)
-        for folder_record in folder_records:
-            offset += out.write(bytes(BSAString(folder_record.value)))
-            for file_record in folder_record.files:
-                offset += out.write(file_record.block(self.archive_flags))
+    @staticmethod
+    def split_path(path: str) -> Tuple[str, str]:
+        """
+        Normalizes a path and splits it in folder name and file name
+
+        :param path: path of a file inside the archive
+        :return: (folder name, file name)
+        """
+        path = path.strip().lower().replace("/", "\\").lstrip("\\")
+        folder_name, _, file_name = path.rpartition("\\")
+        return folder_name, file_name
+
+    def find(self, path: str) -> Optional[int]:
+        """
+        Finds a file by path
+
+        :param path: path of the file inside the archive (eg: textures\\foo\\bar.dds)
+        :return: index of the file record, or None if the file is not in the archive
+        """
+        folder_name, file_name = self.split_path(path)
+        folder_hash = BSAArchive.tes_hash(folder_name)
+        folder_i = bisect_left(self._folder_hashes, folder_hash)
+        if folder_i == len(self._folder_hashes) or self._folder_hashes[folder_i] != folder_hash:
+            return None
+        lo = self._folder_first_file[folder_i]
+        hi = lo + self._folder_counts[folder_i]
+        file_hash = BSAArchive.tes_file_hash(file_name)
+        i = bisect_left(self._file_hashes, file_hash, lo, hi)
+        if i == hi or self._file_hashes[i] != file_hash:
+            return None
+        return i
+
+    def paths(self) -> List[str]:
+        """
+        Returns the paths of all files, in the same order as the file records.
+        This parses folder names and file names, so it's slower than find().
+
+        :return: list of paths (folder\\file name)
+        """
+        if not (self.archive_flags & ArchiveFlags.INCLUDE_FILE_NAMES):
+            raise ValueError("This archive does not include file names")
+        names = bytes(self._view[self._file_names_offset:self._file_names_offset + self.file_names_length])
+        file_names = names.split(b"\x00")
+        r = []
+        for folder_i, position in enumerate(self._folder_names):
+            folder_name = bytes(self._view[position + 1:position + self._view[position]]).decode()
+            first = self._folder_first_file[folder_i]
+            for i in range(first, first + self._folder_counts[folder_i]):
+                r.append(f"{folder_name}\\{file_names[i].decode()}")
+        return r
+
+    def is_compressed(self, i: int) -> bool:
+        """
+        :param i: index of the file record
+        :return: True if the file is compressed
+        """
+        return bool(self.archive_flags & ArchiveFlags.COMPRESSED_ARCHIVE) != bool(
+            self._file_records[i] & BSAFile.INVERT_COMPRESS
+        )
+
+    def raw_data(self, i: int) -> memoryview:
+        """
+        Returns the data block of a file as it's stored in the archive (without the embedded name), without copying it
+
+        :param i: index of the file record
+        :return: memoryview of the mapped archive
+        """
+        record = self._file_records[i]
+        offset = record >> 32
+        size = record & 0x3FFFFFFF
+        if self.archive_flags & ArchiveFlags.EMBED_FILE_NAMES:
+            name_size = 1 + self._view[offset]
+            offset += name_size
+            size -= name_size
+        return self._view[offset:offset + size]
+
+    def read_chunks(self, i: int, chunk_size: int = BSAFile.CHUNK_SIZE) -> Iterator[Union[memoryview, bytes]]:
+        """
+        Returns the data of a file, in chunks. Uncompressed data is not copied,
+        compressed data is decompressed one chunk at a time.
+
+        :param i: index of the file record
+        :param chunk_size: max size of each chunk of stored data
+        :return: iterator of chunks
+        """
+        data = self.raw_data(i)
+        if not self.is_compressed(i):
+            for start in range(0, len(data), chunk_size):
+                yield data[start:start + chunk_size]
+            return
+        data = data[4:]
+        if self.game == Game.SKYRIM_SE:
+            decompressor = lz4.frame.LZ4FrameDecompressor()
+        else:
+            decompressor = zlib.decompressobj()
+        for start in range(0, len(data), chunk_size):
+            yield decompressor.decompress(data[start:start + chunk_size])
+        if self.game != Game.SKYRIM_SE:
+            yield decompressor.flush()
+
+    def read(self, path: str) -> Union[memoryview, bytes]:
+        """
+        Returns the data of a file
+
+        :param path: path of the file inside the archive
+        :return: a memoryview of the mapped archive for uncompressed files, decompressed bytes for compressed files
+        """
+        i = self.find(path)
+        if i is None:
+            raise KeyError(path)
+        if not self.is_compressed(i):
+            return self.raw_data(i)
+        return b"".join(self.read_chunks(i))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Packs the files in a list into a Bethesda BSA file")
+    parser.add_argument(
+        "-i",
+        "--data",
+        help="Absolute path to the 'Data' folder. The files in the list are relative to this folder.",
+        required=True
+    )
+    parser.add_argument(
+        "-l",
+        "--files-list",
+        help="Text file with the paths of the files to pack, one per line, relative to the 'Data' folder",
+        required=True
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Path of the output archive. If not specified, the archive is written to stdout.",
+        required=False
+    )
+    parser.add_argument(
+        "-z",
+        "--compress",
+        action="store_true",
+        help="Compresses the archive",
+        default=False,
+        required=False
+    )
+    parser.add_argument(
+        "-g",
+        "--game",
+        help="Game the archive is for. Default: SKYRIM_SE",
+        choices=[x.name for x in Game],
+        default=Game.SKYRIM_SE.name,
+        required=False
+    )
+    parser.add_argument(
+        "-p",
+        "--parallel",
+        help="Number of processes used to compress the files. Default: 1",
+        type=int,
+        default=1,
+        required=False
+    )
+    parser.add_argument(
+        "--no-share-data",
+        action="store_true",
+        help="Stores identical files once for each copy, instead of only once",
+        default=False,
+        required=False
+    )
+    args = parser.parse_args()
+    archive = BSAArchive(
+        args.data,
+        game=Game[args.game],
+        archive_flags=ArchiveFlags.BETHESDA_DEFAULTS | (ArchiveFlags.COMPRESSED_ARCHIVE if args.compress else 0),
+        share_data=not args.no_share_data
+    )
+    with open(args.files_list, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                archive.add_file(os.path.join(archive.base_dir, line.replace("\\", os.sep)))
+    if args.output is None:
+        archive.write(sys.stdout.buffer, workers=args.parallel)
+    else:
+        with open(args.output, "wb") as f:
+            archive.write(f, workers=args.parallel)
+        if archive.shared_files_count > 0:
+            print(
+                f"* {args.output}: {archive.shared_files_count} duplicate files stored once, "
+                f"{archive.shared_data_size / 1024 / 1024:.2f} MB saved"
+            )
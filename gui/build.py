@@ -0,0 +1,118 @@
+"""
+Runs a build in a background thread, so the GUI stays responsive, and streams its progress to the GUI
+through a queue. The GUI polls the queue with after(), so widgets are only touched by the Tk thread.
+"""
+import traceback
+from collections import namedtuple
+from queue import Queue
+from threading import Event, Lock, Thread
+from typing import Any, Dict, List, Optional
+
+import pigroman
+from utils.metrics import Metrics, Phase
+from utils.scheduler import Cancelled
+
+# kind: "start" or "stop" (of a phase), "done", "cancelled" or "failed" (of the build)
+# phase: the Phase, for "start" and "stop" events
+# message: the error, for "failed" events
+BuildEvent = namedtuple("BuildEvent", "kind phase message")
+
+
+class QueueMetrics(Metrics):
+    """
+    Metrics that also put an event in a queue when a phase starts or stops.
+    Only the start and the end of each phase are queued, not every file: the counters of the running phases
+    are read by the GUI when it refreshes, so a scan of hundreds of thousands of files doesn't flood the queue.
+    """
+
+    def __init__(self, events: Queue):
+        """
+        :param events: queue where the BuildEvents are put
+        """
+        super(QueueMetrics, self).__init__()
+        self.events = events
+        self._running: List[Phase] = []
+        self._running_lock = Lock()
+
+    def start(self, name: str, files: int = 0, bytes_: int = 0) -> Phase:
+        phase = super(QueueMetrics, self).start(name, files, bytes_)
+        with self._running_lock:
+            self._running.append(phase)
+        self.events.put(BuildEvent("start", phase, None))
+        return phase
+
+    def record(self, phase: Phase) -> None:
+        super(QueueMetrics, self).record(phase)
+        with self._running_lock:
+            if phase in self._running:
+                self._running.remove(phase)
+        self.events.put(BuildEvent("stop", phase, None))
+
+    @property
+    def running(self) -> List[Phase]:
+        """
+        :return: the phases that have started and haven't stopped yet, oldest first
+        """
+        with self._running_lock:
+            return list(self._running)
+
+
+class BuildWorker(Thread):
+    """
+    Runs pigroman.main in a background thread. Its progress is put in the events queue as BuildEvents,
+    the last one being "done", "cancelled" or "failed".
+    """
+
+    def __init__(self, **kwargs: Any):
+        """
+        :param kwargs: arguments of pigroman.main, except metrics and cancel
+        """
+        super(BuildWorker, self).__init__(name="build", daemon=True)
+        self.kwargs: Dict[str, Any] = kwargs
+        self.events: Queue = Queue()
+        self.metrics = QueueMetrics(self.events)
+        self._cancel = Event()
+
+    def cancel(self) -> None:
+        """
+        Stops the build as soon as possible. The blocks that are being packed are allowed to finish.
+        """
+        self._cancel.set()
+
+    @property
+    def cancelling(self) -> bool:
+        return self._cancel.is_set()
+
+    def run(self) -> None:
+        try:
+            pigroman.main(metrics=self.metrics, cancel=self._cancel, **self.kwargs)
+        except Cancelled:
+            self.events.put(BuildEvent("cancelled", None, None))
+        except Exception as e:
+            traceback.print_exc()
+            self.events.put(BuildEvent("failed", None, str(e)))
+        else:
+            self.events.put(BuildEvent("done", None, None))
+
+    def poll(self, max_events: int = 100) -> List[BuildEvent]:
+        """
+        Takes the events queued since the last poll, without blocking
+
+        :param max_events: max number of events returned, so a single poll doesn't block the GUI
+        :return: the events, oldest first
+        """
+        events = []
+        while len(events) < max_events and not self.events.empty():
+            events.append(self.events.get_nowait())
+        return events
+
+
+def block_indexes(phase_name: str) -> Optional[List[int]]:
+    """
+    :param phase_name: name of a phase, like "block 3" or "blocks 4, 5"
+    :return: the indexes of the blocks packed by the phase, or None if the phase doesn't pack blocks
+    """
+    kind, _, indexes = phase_name.partition(" ")
+    if kind not in ("block", "blocks"):
+        return None
+    return [int(x) for x in indexes.split(", ")]
@@ -6,9 +6,10 @@ import json
 import os
 from collections import defaultdict, namedtuple
 from tkinter import Tk, StringVar, IntVar, BooleanVar, Menu, filedialog, messagebox
-from tkinter.ttk import Frame, Label, Entry, Button, Scale, Checkbutton, LabelFrame
-from typing import Any, Dict
+from tkinter.ttk import Frame, Label, Entry, Button, Scale, Checkbutton, LabelFrame, Treeview, Scrollbar
+from typing import Any, Dict, Optional
 
+from gui.build import BuildWorker, block_indexes
 from utils import icons, conversions
 
 
@@ -180,9 +181,75 @@ class SubfoldersListFrame(Frame):
             self.update_entry_status_label(x)
 
 
+class ProgressFrame(LabelFrame):
+    """
+    Shows the running phase of the build, with its counters, and the status of each block
+    """
+
+    PHASES = {
+        "scan": "Scanning", "hash": "Looking for duplicates", "ratios": "Estimating compression ratios",
+        "plan": "Planning blocks", "lists": "Writing files lists", "pack": "Packing", "verify": "Verifying archives",
+        "esl": "Creating .esl files",
+    }
+
+    def __init__(self, master, **kwargs):
+        super(ProgressFrame, self).__init__(master, text="Progress", **kwargs)
+        self.grid_columnconfigure(0, weight=1)
+        self.status_label = Label(self, text="Ready")
+        self.status_label.grid(row=0, column=0, columnspan=2, sticky="we")
+        self.blocks_tree = Treeview(self, columns=("status", "files", "size", "time"), height=6)
+        self.blocks_tree.heading("#0", text="Block")
+        self.blocks_tree.column("#0", width=60)
+        for column, text in (("status", "Status"), ("files", "Files"), ("size", "Size"), ("time", "Time")):
+            self.blocks_tree.heading(column, text=text)
+            self.blocks_tree.column(column, width=80, anchor="e")
+        self.blocks_tree.grid(row=1, column=0, sticky="nswe")
+        scrollbar = Scrollbar(self, orient="vertical", command=self.blocks_tree.yview)
+        scrollbar.grid(row=1, column=1, sticky="ns")
+        self.blocks_tree.configure(yscrollcommand=scrollbar.set)
+
+    def clear(self) -> None:
+        self.blocks_tree.delete(*self.blocks_tree.get_children())
+        self.status_label.configure(text="Starting")
+
+    def set_status(self, text: str) -> None:
+        self.status_label.configure(text=text)
+
+    def show_phase(self, phase) -> None:
+        """
+        Shows the counters of a running phase
+
+        :param phase: a running utils.metrics.Phase
+        """
+        text = self.PHASES.get(phase.name, phase.name)
+        if phase.files:
+            text += f": {phase.files} files ({phase.bytes / 1024 / 1024:.1f} MB)"
+        self.status_label.configure(text=text)
+
+    def update_block(self, phase, status: str) -> None:
+        """
+        Adds or updates the rows of the blocks packed by a phase
+
+        :param phase: the utils.metrics.Phase of a block (or of a batch of blocks)
+        :param status: status of the blocks
+        """
+        indexes = block_indexes(phase.name)
+        # The counters of a batch are the sum of its blocks
+        files, size = ("", "") if len(indexes) > 1 else (phase.files, f"{phase.bytes / 1024 / 1024:.1f} MB")
+        values = (status, files, size, f"{phase.seconds:.1f} s" if status != "Packing" else "")
+        for i in indexes:
+            if self.blocks_tree.exists(str(i)):
+                self.blocks_tree.item(str(i), values=values)
+            else:
+                self.blocks_tree.insert("", "end", iid=str(i), text=str(i), values=values)
+                self.blocks_tree.see(str(i))
+
+
 class MainFrame(Frame):
     MIN_ARCHIVE_SIZE = 100 * 1024
     MAX_ARCHIVE_SIZE = 2.5 * 1024 * 1024
+    # Milliseconds between two checks of the build's progress
+    POLL_INTERVAL = 100
 
     def __init__(self, master, **kwargs):
         super(MainFrame, self).__init__(master, **kwargs)
@@ -259,20 +326,99 @@ class MainFrame(Frame):
             compound="left", command=self.build
         )
         self.build_button.grid(
-            row=8, column=0, columnspan=4, sticky="we"
+            row=8, column=0, columnspan=3, sticky="we"
         )
+        self.cancel_button = Button(self, text="Cancel", command=self.cancel, state="disabled")
+        self.cancel_button.grid(row=8, column=3, sticky="we")
+
+        self.progress_frame = ProgressFrame(self)
+        self.progress_frame.grid(row=9, column=0, columnspan=5, sticky="nswe")
 
         self.max_block_size.set(1.5 * 1024 * 1024)
 
+        # The build running in background, if any
+        self.worker: Optional[BuildWorker] = None
+        self.close_when_done = False
+
     def build(self):
         try:
             self.master.check_archive()
             self.check_settings()
-            self.build_button.config(state="disabled")
         except ValueError as e:
             messagebox.showerror("Error", str(e))
-        finally:
-            self.build_button.config(state="enabled")
+            return
+        self.build_button.config(state="disabled")
+        self.cancel_button.config(state="enabled")
+        self.progress_frame.clear()
+        self.worker = BuildWorker(
+            data_path=self.data_path.get(),
+            folders_to_pack=[x.var.get().strip() for x in self.subfolders_list_frame.subfolders if x.var.get().strip()],
+            output_folder=self.output_path.get(),
+            output_name=self.output_name.get().strip(),
+            archive_tool_path=self.master.config_file["archive_tool_path"],
+            max_block_size=int(self.max_block_size.get()) * 1024,
+            compress=self.compress.get(),
+            create_esl=self.create_esl.get(),
+        )
+        self.worker.start()
+        self.after(self.POLL_INTERVAL, self.poll_build)
+
+    def cancel(self):
+        if self.worker is None:
+            return
+        self.worker.cancel()
+        self.cancel_button.config(state="disabled")
+        self.progress_frame.set_status("Cancelling, waiting for the running blocks to finish")
+
+    def poll_build(self):
+        """
+        Shows the progress of the build. Called every POLL_INTERVAL ms while the build is running.
+        Only a bounded number of events is handled each time, so the GUI stays responsive.
+        """
+        finished = None
+        for event in self.worker.poll():
+            if event.kind in ("done", "cancelled", "failed"):
+                finished = event
+            elif block_indexes(event.phase.name) is not None:
+                if event.kind == "start":
+                    self.progress_frame.update_block(event.phase, "Packing")
+                else:
+                    self.progress_frame.update_block(
+                        event.phase, "Done" if event.phase.extra.get("exit_code") == 0 else "Failed"
+                    )
+        if finished is None:
+            # Counters of the running phase, read once per poll instead of being queued for every file
+            if not self.worker.cancelling:
+                running = [x for x in self.worker.metrics.running if x.name in ProgressFrame.PHASES]
+                if running:
+                    self.progress_frame.show_phase(running[-1])
+            self.after(self.POLL_INTERVAL, self.poll_build)
+            return
+
+        self.worker.join()
+        self.worker = None
+        self.build_button.config(state="enabled")
+        self.cancel_button.config(state="disabled")
+        if self.close_when_done:
+            self.master.destroy()
+        elif finished.kind == "done":
+            self.progress_frame.set_status("Done")
+            messagebox.showinfo("Success", "The packages have been created.")
+        elif finished.kind == "cancelled":
+            self.progress_frame.set_status("Cancelled")
+        else:
+            self.progress_frame.set_status("Failed")
+            messagebox.showerror("Error", finished.message)
+
+    def close(self):
+        """
+        Closes the window. If a build is running, it's cancelled first, and the window is closed once it stops.
+        """
+        if self.worker is None:
+            self.master.destroy()
+            return
+        self.close_when_done = True
+        self.cancel()
 
     def check_settings(self):
         if not self.data_path.get().lower().strip().endswith("data"):
@@ -312,6 +458,7 @@ class MainWindow(Tk):
 
         self.main_frame = MainFrame(self)
         self.main_frame.pack(fill="both", padx=10, pady=10)
+        self.protocol("WM_DELETE_WINDOW", self.main_frame.close)
 
     def set_archive_path(self):
         file_path = filedialog.askopenfilename(filetypes=[("Archive.exe", "Archive.exe")])
@@ -1,124 +1,116 @@
 import argparse
 import os
 import shutil
-import subprocess
 import sys
 import time
-from collections import defaultdict
-from threading import Thread
-from typing import Dict, List, Set
-
-from cached_property import cached_property
-import xxhash
+from contextlib import nullcontext
+from threading import Event
+from typing import Dict, List, Optional, Sequence, Set
 
 from utils import conversions
-
-
-def is_ascii(s: str) -> bool:
-    """
-    A function that checks whether a string contains
-    only ASCII characters
-
-    :param s: input string
-    :return: True if it contains only ASCII characters, False otherwise.
-    """
-    return all(ord(c) < 128 for c in s)
-
-
-class File:
-    """
-    A class representing a file that will be packet
-    """
-
-    def __init__(self, path: str, base_dir: str, size: int):
-        """
-        Initializes a new File object
-
-        :param path: absolute path of the file
-        :param base_dir: absolute base (Data) path
-        :param size: size of the file, in bytes
-        """
-        self.path = path.lower().strip()
-        self.base_dir = base_dir.lower().strip()
-        self.size = size
-        self.copied = False
-
-    @property
-    def relative_path(self) -> str:
-        """
-        Returns this file's path, relative to the "Data" folder
-
-        :return:
-        """
-        if not self.path.startswith(self.base_dir):
-            raise RuntimeError(f"The files must be in the base dir ({self.path}, base dir is {self.base_dir})")
-        return self.path[len(self.base_dir):].lstrip("\\").strip()
-
-    @cached_property
-    def hash(self) -> int:
-        """
-        Cached property containing the xxhash of the file
-
-        :return:
-        """
-        with open(self.path, "rb") as f:
-            return xxhash.xxh64_intdigest(f.read())
-
-    def __repr__(self) -> str:
-        return f"<File {self.path} [{self.hash}]>"
-
-    @property
-    def cli_format(self):
-        return f"{self.relative_path}\n"
-
-
-def archive_work(
-    block_i: int, archive_tool_path: str, compress: bool, data_path: str, output_folder: str, output_name: str
-) -> None:
-    # Write script
-    with open(f"{archive_tool_path}\\script_{block_i}.txt", "w") as f:
-        # TODO: Automatically determine CHECKs
-        for x in (
-            f"Log: log_{block_i}.txt",
-            "New Archive",
-            "Check: Textures",
-            "Check: Meshes",
-            "Check: Voices",
-            "Check: Sounds",
-            "Check: Misc",
-            "Check: Compress Archive" if compress else "",
-            f"Set File Group Root: {data_path}\\",
-            f"Add File Group: {archive_tool_path}\\files_{block_i}.txt",
-            f"Save Archive: {output_folder}\\{output_name}{block_i if block_i > 0 else ''}.bsa"
-        ):
-            f.write(f"{x}\r\n")
-
-    # Copy the files list
-    shutil.copy(f"out_{block_i}.txt", f"{archive_tool_path}\\files_{block_i}.txt")
-
-    # Execute Archive.exe, and provide it the script
-    subprocess.run([f"{archive_tool_path}\\Archive.exe", f"script_{block_i}.txt"], cwd=archive_tool_path)
-
-    # Delete temp script and files list
-    os.remove(f"{archive_tool_path}\\script_{block_i}.txt")
-    os.remove(f"{archive_tool_path}\\files_{block_i}.txt")
+from utils.backends import ArchiveExeBackend, BACKENDS
+from utils.cache import HashCache
+from utils.dedup import TieredDeduplicator
+from utils.files import File, ListSize
+from utils.filters import FileFilter
+from utils.metrics import Metrics
+from utils.planner import GreedyPlanner, PLANNERS, get_planner, print_report
+from utils.ratios import CompressionRatios
+from utils.scanner import Scanner
+from utils.scheduler import BlockPipeline, JobStatus, check_cancelled, schedule_blocks
+from utils.verify import normalize_path, verify_archives
 
 
 def check_and_sanitize_data_subfolders(data_path: str, subfolders: List[str]) -> None:
     for i in range(len(subfolders)):
-        subfolders[i] = subfolders[i].strip().rstrip("\\").lower()
-        if not subfolders[i].startswith(data_path):
-            subfolders[i] = f"{data_path}\\{subfolders[i]}"
+        subfolders[i] = subfolders[i].strip().rstrip(os.sep)
+        if not os.path.normcase(subfolders[i]).startswith(os.path.normcase(data_path)):
+            subfolders[i] = os.path.join(data_path, subfolders[i])
             if not os.path.isdir(subfolders[i]):
                 raise ValueError(f"{subfolders[i]} is not inside data path")
 
 
+def write_files_list(
+    path: str, files: List[File], block: Sequence[int], groups: Dict[File, Set[File]], aggregate_duplicates: bool
+) -> ListSize:
+    """
+    Writes the files list of a block
+
+    :param path: path of the files list
+    :param files: File objects, in scan order
+    :param block: indexes in files of the files of the block
+    :param groups: File -> group of identical files. Used only if aggregate_duplicates is True.
+    :param aggregate_duplicates: if True, all the duplicates of a file are put in the same block
+    :return: size of the list
+    """
+    files_count = 0
+    files_size = 0
+    estimated_size = 0
+    with open(path, "w") as f:
+        for file_i in block:
+            file = files[file_i]
+            if file.copied:
+                # This file has already been copied, do not put it in this block
+                continue
+            f.write(file.cli_format)
+            files_count += 1
+            files_size += file.size
+            estimated_size += file.estimated_size
+
+            # This file gets copied now
+            file.copied = True
+
+            # Copy all its duplicates as well if we're in aggregate mode
+            if aggregate_duplicates:
+                for duplicate in groups.get(file, ()):
+                    if duplicate is file:
+                        # That's us, not a duplicate
+                        continue
+
+                    # Actual duplicate, copy it as well
+                    f.write(duplicate.cli_format)
+                    duplicate.copied = True
+                    files_count += 1
+                    files_size += duplicate.size
+                    estimated_size += duplicate.estimated_size
+    return ListSize(files_count, files_size, estimated_size)
+
+
+def write_files_lists(
+    files: List[File], blocks: List[Sequence[int]], duplicates: Dict[int, Set[File]], aggregate_duplicates: bool,
+    folder: str = ""
+) -> List[ListSize]:
+    """
+    Writes the files list of each block (out_{i}.txt)
+
+    :param files: File objects, in scan order
+    :param blocks: indexes in files of the files of each block
+    :param duplicates: xxhash -> set of identical 'File's. Used only if aggregate_duplicates is True.
+    :param aggregate_duplicates: if True, all the duplicates of a file are put in the same block
+    :param folder: folder where the lists are written. Default: working directory.
+    :return: size of each list
+    """
+    # File -> group of identical files. Files without duplicates are never hashed.
+    groups: Dict[File, Set[File]] = {
+        file: group for group in duplicates.values() for file in group
+    } if aggregate_duplicates else {}
+    return [
+        write_files_list(os.path.join(folder, f"out_{i}.txt"), files, block, groups, aggregate_duplicates)
+        for i, block in enumerate(blocks)
+    ]
+
+
 def main(
     data_path: str, folders_to_pack: List[str], output_folder: str,
     output_name: str, archive_tool_path: str, max_block_size: int = 700 * 1024 * 1024,
     compress: bool = False, create_esl: bool = True,
     max_workers: int = 1, aggregate_duplicates: bool = False,
-    folders_to_ignore: List[str] = None,
+    folders_to_ignore: List[str] = None, scan_workers: int = 4, use_cache: bool = True,
+    planner: str = "greedy", backend: str = ArchiveExeBackend.name, verify: bool = False,
+    metrics: Optional[Metrics] = None, batch_size: int = 1, hash_workers: int = 1, hash_processes: bool = False,
+    pipelined: bool = False, include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+    extensions: Optional[List[str]] = None, not_extensions: Optional[List[str]] = None,
+    min_file_size: Optional[int] = None, max_file_size: Optional[int] = None, cancel: Optional[Event] = None,
 ) -> None:
     """
 
@@ -129,18 +121,50 @@ def main(
                            or simply the name of a subfolder)
     :param output_folder: absolute path to the output folder
     :param output_name: name of the output archives. Will append a number, starting from 0.
-    :param archive_tool_path: absolute path of the folder containing Archive.exe
+    :param archive_tool_path: absolute path of the folder containing Archive.exe. Used only by the Archive.exe backend.
     :param max_block_size: max size, in bytes, that an archive can assume before creating a new archive.
                            note that the last archive can be up to 1/4 bigger than that.
     :param compress: if True, the archive will be compressed. If False, it won't.
+                     Compressed archives are filled up to max_block_size after compression, using the compression
+                     ratio of each file type, learnt from the previous runs (or from a sample of the files).
+    :param scan_workers: number of threads used to list the folders to pack.
+    :param use_cache: if True, the files' hashes are cached in output_folder, and files that haven't
+                      changed since the last run are not hashed again. Used only if aggregate_duplicates is True.
+    :param planner: name of the algorithm used to split the files in blocks. See utils.planner.PLANNERS.
+    :param backend: name of the packer used to create the archives. See utils.backends.BACKENDS.
+    :param verify: if True, once all archives have been created, makes sure that they contain all the files
+                   in their files lists, with the same data as the source files. Also writes a manifest
+                   with the xxhash of each file next to each archive.
+    :param batch_size: max number of blocks packed by each Archive.exe run. Batching many small blocks
+                       saves the startup time of Archive.exe.
+    :param metrics: where the timers and counters of each phase are recorded. If None, they are discarded.
+    :param hash_workers: number of files hashed at the same time while scanning. Used only if aggregate_duplicates
+                         is True.
+    :param hash_processes: if True, the files are hashed by hash_workers processes instead of threads.
+    :param pipelined: if True, each block is packed as soon as it's full, while the next ones are being scanned.
+                      Works only with the greedy planner, without aggregate_duplicates. Compressed archives are
+                      estimated from the compression ratios of the previous runs only.
+    :param include: if specified, only the files that match one of these globs are packed.
+                    Globs without a slash match the file name, the others the path relative to data_path.
+    :param exclude: files that match one of these globs are not packed
+    :param extensions: if specified, only the files with one of these extensions are packed
+    :param not_extensions: files with one of these extensions are not packed
+    :param min_file_size: files smaller than this, in bytes, are not packed
+    :param max_file_size: files bigger than this, in bytes, are not packed
+    :param cancel: if set while the build is running, the build stops as soon as possible:
+                   the blocks that are being packed are allowed to finish, and utils.scheduler.Cancelled is raised.
     :return:
     """
+    if metrics is None:
+        metrics = Metrics()
+    total_phase = metrics.start("total")
+
     # Sanitize output folder
-    output_folder = output_folder.rstrip("\\").strip()
+    output_folder = output_folder.rstrip(os.sep).strip()
 
-    # Sanitize data path, and make sure it's called "Data"
-    data_path = data_path.rstrip("\\").strip().lower()
-    if not data_path.endswith("data"):
+    # Sanitize data path, and make sure it's called "Data". Its case is kept, as file systems may be case-sensitive.
+    data_path = data_path.rstrip(os.sep).strip()
+    if not data_path.lower().endswith("data"):
         raise ValueError("Data path must be a folder called Data")
 
     # Check all folders to pack. They must be data_path's subfolders
@@ -152,183 +176,267 @@ def main(
     #         if not os.path.isdir(folders_to_pack[i]):
     #             raise ValueError("Folder to pack must be inside data path")
 
+    # The files of a folder inside another folder to pack would be listed twice
+    folders_to_pack[:] = [
+        x for x in dict.fromkeys(folders_to_pack) if not any(x.startswith(y + os.sep) for y in folders_to_pack)
+    ]
+
+    if pipelined and (planner != "greedy" or aggregate_duplicates):
+        raise ValueError("Pipelined packing works only with the greedy planner, without aggregating duplicates")
+
     # Check all folders to ignore
     if folders_to_ignore is None:
         folders_to_ignore = []
     check_and_sanitize_data_subfolders(data_path, folders_to_ignore)
 
-    # xxhash -> set of duplicate 'File's
-    duplicates: Dict[int, Set[File]] = defaultdict(set)
-
-    # BSA archives
-    blocks: List[List[File]] = []
-
-    # absolute file path -> 'File'
-    files: Dict[str, File] = {}
-
-    # Total files counter, used to show progress every 1000 processed files
-    total_i = 0
-
-    # Current block variables
-    block_size = 0
-    block_size_bytes = 0
-    block_files: List[File] = []
+    # xxhash -> set of identical 'File's (at least two)
+    duplicates: Dict[int, Set[File]] = {}
+
+    # 'File's, in scan order. Blocks refer to them by index.
+    files: List[File] = []
+
+    # Persistent xxhash cache, so unchanged files don't get hashed again
+    cache = None
+    if aggregate_duplicates and use_cache:
+        cache = HashCache(os.path.join(output_folder, HashCache.FILE_NAME))
+
+    # The files are hashed while the folders are being scanned, as soon as they might have a duplicate
+    deduplicator = TieredDeduplicator(workers=hash_workers, use_processes=hash_processes)
+
+    # Archive.exe or the native packer
+    backend_kwargs = dict(data_path=data_path, output_folder=output_folder, output_name=output_name, compress=compress)
+    if backend == ArchiveExeBackend.name:
+        packer = ArchiveExeBackend(archive_tool_path=archive_tool_path, **backend_kwargs)
+    else:
+        packer = BACKENDS[backend](**backend_kwargs)
+
+    # Compressed archives are filled up to the max size after compression
+    ratios = None
+    if compress:
+        ratios = CompressionRatios(os.path.join(output_folder, CompressionRatios.FILE_NAME))
+
+    # In pipelined mode, each block is packed as soon as it's full, while the next ones are being scanned
+    greedy = None
+    pipeline = None
+    if pipelined:
+        greedy = GreedyPlanner(max_block_size)
+        pipeline = BlockPipeline(packer, max_workers, metrics, batch_size=batch_size, cancel=cancel)
+
+    def dispatch(block: Sequence[int]) -> None:
+        # Write the files list straight where the packer reads it, and start packing it
+        files_list_path = packer.files_list_path(len(pipeline.lists_sizes))
+        list_size = write_files_list(files_list_path, files, block, {}, aggregate_duplicates=False)
+        block_i = pipeline.add(list_size, files_list_path)
+        print(f"+ Block {block_i}: {list_size.files_count} files, {list_size.estimated_size / 1024 / 1024} MB")
+
+    # Rules that decide which files are packed, compiled once
+    file_filter = FileFilter(
+        data_path, exclude_folders=folders_to_ignore, include_globs=include or (), exclude_globs=exclude or (),
+        include_extensions=extensions or (), exclude_extensions=not_extensions or (),
+        min_size=min_file_size, max_size=max_file_size
+    )
 
-    # Process each folder
-    for folder_to_pack in folders_to_pack:
-        # Each subfolder
-        for root, dirs, files_ in os.walk(folder_to_pack):
-            # Make sure this subfolder is not ignored
-            if any(root.lower().startswith(f_i) for f_i in folders_to_ignore):
-                print(f"! Skipped subfolder {root}")
-                continue
+    # Process each file, in a deterministic order
+    scanner = Scanner(data_path, file_filter=file_filter, max_workers=scan_workers)
+    # Temp files left over by the packer are deleted at the end, even if the build fails.
+    # The files lists written in the packer's folder are needed until the archives have been verified.
+    try:
+        with deduplicator, pipeline if pipeline is not None else nullcontext():
+            pack_phase = metrics.start("pack") if pipelined else None
+            with metrics.phase("scan") as phase:
+                for file_object in scanner.scan(folders_to_pack):
+                    check_cancelled(cancel)
+                    # Counted as they go, so the progress of the scan can be followed while it's running
+                    phase.files = scanner.files_count
+                    phase.bytes = scanner.bytes_count
+
+                    # Reuse its hash if it hasn't changed since the last run...
+                    if cache is not None:
+                        cache.apply(file_object)
+
+                    # ...add it to the list of files...
+                    files.append(file_object)
+
+                    # ...and look for its duplicates
+                    if aggregate_duplicates:
+                        deduplicator.add(file_object)
+
+                    if pipeline is not None:
+                        # Only the compression ratios learnt from the previous runs are used, as the files
+                        # are packed before all of them have been scanned
+                        if ratios is not None:
+                            file_object.estimated_size = ratios.estimate(file_object)
+                        block = greedy.add(file_object)
+                        if block is not None:
+                            dispatch(block)
+                        if pipeline.failed:
+                            # Fail fast, don't scan the other files
+                            break
+                phase.files = scanner.files_count
+                phase.bytes = scanner.bytes_count
+            print(
+                f"* Scanned {scanner.files_count} files in {scanner.elapsed:.2f} s "
+                f"({scanner.files_per_second:.0f} files/s)"
+            )
+            file_filter.print_report()
+            check_cancelled(cancel)
+
+            # Wait for the files that are still being hashed
+            if aggregate_duplicates:
+                with metrics.phase("hash", len(files)) as phase:
+                    duplicates = deduplicator.result()
+                    phase.bytes = deduplicator.bytes_read
+                    phase.extra.update(
+                        workers=hash_workers,
+                        partial_hashes=deduplicator.partial_hashes,
+                        full_hashes=deduplicator.full_hashes,
+                        full_hash_bytes=deduplicator.full_hash_bytes
+                    )
+                    if cache is not None:
+                        phase.extra.update(cache_hits=cache.hits, cache_misses=cache.misses)
+                print(
+                    f"* Found {len(duplicates)} groups of identical files, {phase.seconds:.2f} s after the scan, "
+                    f"read {deduplicator.bytes_read / 1024 / 1024:.1f} MB "
+                    f"instead of {deduplicator.full_hash_bytes / 1024 / 1024:.1f} MB "
+                    f"({deduplicator.partial_hashes} partial hashes, {deduplicator.full_hashes} full hashes)"
+                )
 
-            # And each file
-            for file in files_:
-                file_path = os.path.join(os.sep, root, file).lower()
-
-                # Make sure the file is valid
-                # TODO: Other filters
-                if not os.path.isfile(file_path) \
-                        or file_path.split("\\")[-1].startswith(".") \
-                        or os.path.islink(file_path):
-                    print(f"! Skipped {file_path}")
-                    continue
-
-                # Print a warning if the file name contains non-ascii characters, as they may cause issues
-                if not is_ascii(file_path):
-                    print(f"! Non-ASCII file name ({file_path})")
-                total_i += 1
-                file_size = os.path.getsize(file_path)
-
-                # Create a File object
-                file_object = File(
-                    file_path,
-                    base_dir=data_path,
-                    size=file_size
+            # Pack the last blocks, and wait for all blocks to be packed
+            check_cancelled(cancel)
+            if pipeline is not None:
+                try:
+                    if not pipeline.failed:
+                        for block in greedy.finish():
+                            dispatch(block)
+                    results = pipeline.finish()
+                finally:
+                    lists_sizes = pipeline.lists_sizes
+                    pack_phase.files = sum(x.files_count for x in lists_sizes)
+                    pack_phase.bytes = sum(x.size for x in lists_sizes)
+                    metrics.stop(pack_phase)
+                block_planner = greedy
+                blocks = greedy.blocks
+                lists_paths = [packer.files_list_path(i) for i in range(len(blocks))]
+        if cache is not None:
+            pruned = cache.save(files, roots=folders_to_pack)
+            cache.close()
+            print(f"* Hash cache: {cache.hits} hits, {cache.misses} misses, {pruned} deleted files pruned")
+
+        if not pipelined:
+            if ratios is not None:
+                with metrics.phase("ratios") as phase:
+                    phase.files = ratios.sample(files)
+                    for file in files:
+                        file.estimated_size = ratios.estimate(file)
+                print(
+                    "* Estimated compression ratios: "
+                    + ", ".join(f"{x} {ratios.ratio(x):.2f}" for x in sorted({ratios.extension(x) for x in files}))
                 )
 
-                # Add it to the duplicates defaultdict...
-                if aggregate_duplicates:
-                    duplicates[file_object.hash].add(file_object)
-
-                # ...to the path -> File dictionary...
-                files[file_object.path] = file_object
-
-                # ...and to the current block's files
-                block_files.append(file_object)
-
-                # Also increase the size in bytes and number of files of this block
-                block_size_bytes += file_size
-                block_size += file_size
-
-                if block_size >= max_block_size:
-                    # Block exceeded max size, create a permanent new block
-                    print(f"+ Created a new block with {len(block_files)} files, { block_size_bytes / 1024 / 1024 } MB")
-                    blocks.append(block_files)
-
-                    # Reset local block variables
-                    block_files = []
-                    block_size = 0
-                    block_size_bytes = 0
-
-                # Print progress every 1000 items
-                if total_i % 1000 == 0:
-                    print(f"* Processed {total_i} files")
-
-    # No more files to process.
-    # Make the last local block permanent
-    # Or add the files in the local block to the last permanent block if they're few
-    if block_files:
-        if block_size < max_block_size / 4 and blocks:
-            blocks[-1].extend(block_files)
-            size_bytes = sum(x.size for x in blocks[-1])
-            print(
-                f"+ Merged last block ({len(block_files)} files) with "
-                f"2nd last one, now { size_bytes / 1024 / 1024 } MB"
+            # Split the files in blocks
+            with metrics.phase("plan", len(files), scanner.bytes_count) as phase:
+                block_planner = get_planner(planner, max_block_size, output_folder)
+                blocks = block_planner.plan(files)
+                phase.extra["blocks"] = len(blocks)
+            print(f"* Planned {len(blocks)} blocks in {phase.seconds:.2f} s")
+            print_report(blocks, files, max_block_size, planner)
+
+            # Create a file lists for each block
+            with metrics.phase("lists", len(files)):
+                lists_sizes = write_files_lists(files, blocks, duplicates, aggregate_duplicates)
+            lists_paths = [f"out_{i}.txt" for i in range(len(blocks))]
+
+            # Calculate duplicates and saved size
+            print(f"\n* Created file lists for {len(blocks)} blocks")
+            c = 0
+            w = 0
+            for k, v in duplicates.items():
+                if len(v) > 1:
+                    c += len(v) - 1
+                    w += next(iter(v)).size
+            print(f"* Total duplicates: {c}")
+            print(f"* Saved size: {w / 1024 / 1024} MB")
+
+            # Pack files with Archive.exe or the native packer
+            # if input("Do you want to pack the files? [y/N]").lower().strip() != "y":
+            #     return
+            pack_phase = metrics.start(
+                "pack", sum(x.files_count for x in lists_sizes), sum(x.size for x in lists_sizes)
             )
-        else:
-            print(f"+ Created last block with {len(block_files)} files, { block_size_bytes / 1024 / 1024} MB")
-            blocks.append(block_files)
-
-    # Create a file lists for each block
-    for i, block in enumerate(blocks):
-        with open(f"out_{i}.txt", "w") as f:
-            for file in block:
-                if file.copied:
-                    # This file has already been copied, do not put it in this block
-                    continue
-                f.write(file.cli_format)
-
-                # This file gets copied now
-                file.copied = True
-
-                # Copy all its duplicates as well if we're in aggregate mode
-                if aggregate_duplicates:
-                    for duplicate in duplicates[file.hash]:
-                        if duplicate.path == file.path:
-                            # That's us, not a duplicate
-                            continue
-
-                        # Actual duplicate, copy it as well
-                        f.write(duplicate.cli_format)
-                        duplicate.copied = True
-
-    # Calculate duplicates and saved size
-    print(f"\n* Created file lists for {len(blocks)} blocks")
-    c = 0
-    w = 0
-    for k, v in duplicates.items():
-        if len(v) > 1:
-            c += len(v) - 1
-            w += files[next(iter(v)).path].size
-    print(f"* Total duplicates: {c}")
-    print(f"* Saved size: {w / 1024 / 1024} MB")
-
-    # Pack files with Archive.exe
-    # if input("Do you want to pack the files? [y/N]").lower().strip() != "y":
-    #     return
-    workers: Set[Thread] = set()
-    for i, block in enumerate(blocks):
-        print(f"* Packing block {i+1}/{len(blocks)}")
-        w = Thread(
-            target=lambda: archive_work(
-                i,
-                archive_tool_path=archive_tool_path, compress=compress,
-                data_path=data_path, output_folder=output_folder, output_name=output_name
+            try:
+                results = schedule_blocks(
+                    packer, lists_sizes, max_workers, metrics, batch_size=batch_size, cancel=cancel
+                )
+            finally:
+                metrics.stop(pack_phase)
+        failed = [x.block_i for x in results if x.status != JobStatus.DONE]
+        if failed:
+            raise RuntimeError(f"Could not pack blocks {failed}")
+
+        # Delete the archives of the previous run that no longer have any file, and save the layout of this run.
+        # Both are done only now, so a failed build leaves the previous archives and layout untouched.
+        for i in block_planner.stale_blocks:
+            for path in (packer.archive_path(i), f"{os.path.splitext(packer.archive_path(i))[0]}.esl"):
+                if os.path.isfile(path):
+                    print(f"* Deleting {path}, its files have been removed")
+                    os.remove(path)
+        block_planner.save(blocks, files)
+
+        # Compare the estimated sizes with the actual ones, and learn the actual compression ratios
+        if ratios is not None:
+            archives = [packer.archive_path(i) for i in range(len(blocks)) if os.path.isfile(packer.archive_path(i))]
+            for i, list_size in enumerate(lists_sizes):
+                if packer.archive_path(i) in archives and list_size.estimated_size > 0:
+                    actual = os.path.getsize(packer.archive_path(i))
+                    print(
+                        f"+ Block {i}: estimated {list_size.estimated_size / 1024 / 1024:.1f} MB, "
+                        f"actual {actual / 1024 / 1024:.1f} MB "
+                        f"({(actual - list_size.estimated_size) / list_size.estimated_size * 100:+.1f}%)"
+                    )
+            ratios.learn(archives, {normalize_path(x.relative_path): x for x in files})
+            ratios.save()
+
+        # Make sure that the archives contain the right files
+        check_cancelled(cancel)
+        if verify:
+            print("* Verifying archives")
+            verify_phase = metrics.start("verify", pack_phase.files, pack_phase.bytes)
+            archives = {
+                packer.archive_path(i): lists_paths[i]
+                for i in range(len(blocks))
+                # Blocks made only of duplicates that have been copied somewhere else have no archive
+                if os.path.getsize(lists_paths[i]) > 0
+            }
+            # Don't hash the files that have already been hashed to aggregate duplicates
+            source_hashes = {
+                normalize_path(x.relative_path): x.hash for x in files if x.has_hash
+            }
+            # The paths in the archives are lower case, the source files are opened with their case on disk
+            source_paths = {normalize_path(x.relative_path): x.path for x in files}
+            verified = verify_archives(
+                archives, data_path, max_workers=max_workers, source_hashes=source_hashes, source_paths=source_paths
             )
-        )
-        workers.add(w)
-        w.start()
-
-        # Wait for some worker to finish before spawning new ones
-        while len(workers) >= max_workers:
-            to_remove = set()
-            for w in workers:
-                w.join(timeout=1)
-                if not w.is_alive():
-                    to_remove.add(w)
-            workers -= to_remove
-
-    # Wait for any remaining workers
-    for w in workers:
-        w.join()
-
-    # Delete temp .bsl files left over by Archive.exe
-    print("* Deleting .bsl files")
-    for file in os.listdir(output_folder):
-        if file.endswith(".bsl"):
-            os.remove(os.path.join(output_folder, file))
+            metrics.stop(verify_phase)
+            if not verified:
+                raise RuntimeError("Some archives do not contain the right files")
+    finally:
+        packer.cleanup()
 
     # Create an .esl file for each archive
     # if input("Do you want to create .esl files [y/N]").lower().strip() != "y":
     #     return
     if create_esl:
         print("* Creating .esl files")
-        for file in os.listdir(output_folder):
-            if file.endswith(".bsa"):
-                file_name = file.split("\\")[-1].split(".")[0]
-                shutil.copy("empty.esl", f"{output_folder}\\{file_name}.esl")
+        with metrics.phase("esl") as phase:
+            for file in os.listdir(output_folder):
+                if file.endswith(".bsa"):
+                    file_name = file.split(".")[0]
+                    shutil.copy("empty.esl", os.path.join(output_folder, f"{file_name}.esl"))
+                    phase.files += 1
+
+    total_phase.files = scanner.files_count
+    total_phase.bytes = scanner.bytes_count
+    metrics.stop(total_phase)
 
 
 def cast_workers_number(x: str) -> int:
@@ -344,7 +452,8 @@ if __name__ == '__main__':
         "-z",
         "--compress",
         action="store_true",
-        help="Compresses the output archives",
+        help="Compresses the output archives. The archives are filled up to the max block size after compression, "
+             "estimated from the compression ratio of each file type in the previous runs.",
         default=False,
         required=False
     )
@@ -353,7 +462,8 @@ if __name__ == '__main__':
         "--aggregate-duplicates",
         action="store_true",
         help="Experimental option that aggregates identical files into the same archive. "
-             "Archive.exe seems to ignore this.",
+             "Archive.exe seems to ignore this, the native backend stores them only once "
+             "(except in texture archives, where each file embeds its name).",
         default=False,
         required=False
     )
@@ -395,7 +505,42 @@ if __name__ == '__main__':
         "-nf",
         "--not-folder",
         nargs="+",
-        help="Subfolders to exclude in the archive.",
+        help="Subfolders to exclude in the archive. They are not scanned at all.",
+        required=False
+    )
+    parser.add_argument(
+        "--include",
+        nargs="+",
+        help="Packs only the files that match one of these globs (eg: '*.dds' 'meshes/armor/*'). "
+             "Globs without a slash match the file name, the others the path relative to the 'Data' folder.",
+        required=False
+    )
+    parser.add_argument(
+        "--exclude",
+        nargs="+",
+        help="Files that match one of these globs are not packed.",
+        required=False
+    )
+    parser.add_argument(
+        "--ext",
+        nargs="+",
+        help="Packs only the files with one of these extensions (eg: dds nif).",
+        required=False
+    )
+    parser.add_argument(
+        "--not-ext",
+        nargs="+",
+        help="Files with one of these extensions are not packed.",
+        required=False
+    )
+    parser.add_argument(
+        "--min-file-size",
+        help="Files smaller than this are not packed (eg: 1K).",
+        required=False
+    )
+    parser.add_argument(
+        "--max-file-size",
+        help="Files bigger than this are not packed (eg: 100M).",
         required=False
     )
     parser.add_argument(
@@ -413,8 +558,8 @@ if __name__ == '__main__':
     parser.add_argument(
         "-a",
         "--archive-folder",
-        help="Absolute path to the folder that contains Archive.exe",
-        required=True
+        help="Absolute path to the folder that contains Archive.exe. Required by the archive.exe backend.",
+        required=False
     )
     parser.add_argument(
         "-p",
@@ -424,23 +569,131 @@ if __name__ == '__main__':
         default=1,
         required=False
     )
+    parser.add_argument(
+        "-t",
+        "--scan-threads",
+        help="Specifies how many folders can be scanned at the same time. Default: 4",
+        type=cast_workers_number,
+        default=4,
+        required=False
+    )
+    parser.add_argument(
+        "--hash-workers",
+        help="Specifies how many files can be hashed at the same time, while the folders are being scanned. "
+             "Used only with --aggregate-duplicates. Default: 1",
+        type=cast_workers_number,
+        default=1,
+        required=False
+    )
+    parser.add_argument(
+        "--hash-processes",
+        action="store_true",
+        help="Hashes the files with --hash-workers processes instead of threads.",
+        default=False,
+        required=False
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Hashes all files again, instead of reusing the hashes of the unchanged files from the previous run. "
+             "Used only with --aggregate-duplicates.",
+        default=False,
+        required=False
+    )
+    parser.add_argument(
+        "-l",
+        "--planner",
+        help="Algorithm used to split the files in archives. "
+             "'greedy' fills the archives in scan order. "
+             "'stable' keeps the files in the same archives as the previous run, "
+             "so small changes only affect a few archives. "
+             "'ffd' (first fit decreasing) creates close to the fewest archives. "
+             "'balanced' creates close to the fewest archives, all about the same size. "
+             "'folders' keeps the files of each folder in the same archive whenever possible. Default: greedy",
+        choices=PLANNERS,
+        default="greedy",
+        required=False
+    )
+    parser.add_argument(
+        "-b",
+        "--backend",
+        help="Packer used to create the archives. "
+             "'archive.exe' uses Archive.exe from the Creation Kit (Windows only). "
+             "'native' uses the built-in Python packer. Default: archive.exe",
+        choices=BACKENDS,
+        default=ArchiveExeBackend.name,
+        required=False
+    )
+    parser.add_argument(
+        "-v",
+        "--verify",
+        action="store_true",
+        help="Makes sure that the archives contain all the right files once they have been created, "
+             "and writes a manifest with the xxhash of each file next to each archive.",
+        default=False,
+        required=False
+    )
+    parser.add_argument(
+        "--batch",
+        help="Packs up to this many archives with each Archive.exe run. "
+             "Saves time when there are many small archives. Default: 1",
+        type=cast_workers_number,
+        default=1,
+        required=False
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="Starts packing each archive as soon as its files have been scanned, while the next ones are being "
+             "scanned. Works only with the greedy planner, and not with --aggregate-duplicates. "
+             "Compressed archives are filled using the compression ratios of the previous runs only.",
+        default=False,
+        required=False
+    )
+    parser.add_argument(
+        "--metrics",
+        help="Writes the time, files/s, bytes/s and peak memory usage of each phase and of each block "
+             "to this file, as JSON lines.",
+        required=False
+    )
+    parser.add_argument(
+        "--summary",
+        action="store_true",
+        help="Prints a table with the time of each phase and of each block at the end.",
+        default=False,
+        required=False
+    )
     args = parser.parse_args()
     max_block_size = conversions.readable_size_to_number(args.max_block_size)
+    min_file_size = conversions.readable_size_to_number(args.min_file_size) if args.min_file_size else None
+    max_file_size = conversions.readable_size_to_number(args.max_file_size) if args.max_file_size else None
     st = time.monotonic()
     print(f"# Data path: {args.data}")
     print(f"# Folders to pack: {args.folder}")
     print(f"# Folders NOT to pack: {args.not_folder}")
+    print(f"# Include: {args.include}, exclude: {args.exclude}")
+    print(f"# Extensions: {args.ext}, not: {args.not_ext}")
+    print(f"# File size: {min_file_size} - {max_file_size} bytes")
     print(f"# Output folder: {args.output_folder}")
     print(f"# Output base name: {args.output_name}[...].bsa")
+    print(f"# Backend: {args.backend}")
     print(f"# Archive tool path: {args.archive_folder}")
     print(f"# Create ESL: {args.esl}")
     print(f"# Compress: {args.compress}")
     print(f"# Aggregating: {args.aggregate_duplicates}")
+    print(f"# Verify: {args.verify}")
+    print(f"# Pipelined: {args.pipeline}")
     print(f"# Max block size: ~{max_block_size / 1024 / 1024} MB "
           f"(up to {(max_block_size + max_block_size / 4) / 1024 / 1024} MB)")
-    if not os.path.isfile(f"{args.archive_folder}\\Archive.exe"):
+    if args.backend == ArchiveExeBackend.name and (
+        args.archive_folder is None or not os.path.isfile(os.path.join(args.archive_folder, "Archive.exe"))
+    ):
         sys.exit(f"Cannot find Archive.exe in {args.archive_folder}")
+    if args.pipeline and (args.planner != "greedy" or args.aggregate_duplicates):
+        sys.exit("--pipeline works only with the greedy planner, and not with --aggregate-duplicates")
     print()
+    metrics_file = open(args.metrics, "w") if args.metrics is not None else None
+    metrics = Metrics(metrics_file)
     main(
         data_path=args.data,
         folders_to_pack=args.folder,
@@ -452,7 +705,27 @@ if __name__ == '__main__':
         compress=args.compress,
         max_block_size=max_block_size,
         max_workers=args.parallel,
+        scan_workers=args.scan_threads,
+        use_cache=not args.no_cache,
+        planner=args.planner,
+        backend=args.backend,
+        verify=args.verify,
+        metrics=metrics,
+        batch_size=args.batch,
+        hash_workers=args.hash_workers,
+        hash_processes=args.hash_processes,
+        pipelined=args.pipeline,
+        include=args.include,
+        exclude=args.exclude,
+        extensions=args.ext,
+        not_extensions=args.not_ext,
+        min_file_size=min_file_size,
+        max_file_size=max_file_size,
         aggregate_duplicates=args.aggregate_duplicates
     )
+    if metrics_file is not None:
+        metrics_file.close()
+    if args.summary:
+        metrics.print_summary()
     et = time.monotonic()
     print(f"* Took {et - st} s")
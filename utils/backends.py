@@ -0,0 +1,224 @@
+import os
+import re
+import shutil
+import subprocess
+import sys
+from abc import ABC, abstractmethod
+from typing import List
+
+import bsa
+
+
+class Backend(ABC):
+    """
+    Packs the files of a block into an archive
+    """
+
+    name = ""
+
+    def __init__(self, data_path: str, output_folder: str, output_name: str, compress: bool):
+        """
+        :param data_path: absolute path of the "Data" folder
+        :param output_folder: absolute path of the output folder
+        :param output_name: base name of the output archives
+        :param compress: if True, the archives will be compressed
+        """
+        self.data_path = data_path
+        self.output_folder = output_folder
+        self.output_name = output_name
+        self.compress = compress
+
+    def archive_path(self, block_i: int) -> str:
+        """
+        Returns the path of the archive of a block
+
+        :param block_i: index of the block
+        :return: absolute path of the output archive
+        """
+        return os.path.join(self.output_folder, f"{self.output_name}{block_i if block_i > 0 else ''}.bsa")
+
+    def files_list_path(self, block_i: int) -> str:
+        """
+        Returns where the packer reads the files list of a block from.
+        Lists written there are not copied before packing.
+
+        :param block_i: index of the block
+        :return: path of the files list
+        """
+        return f"out_{block_i}.txt"
+
+    @abstractmethod
+    def pack(self, block_i: int, files_list_path: str) -> int:
+        """
+        Packs a block. This method is called from worker threads, one block per thread.
+
+        :param block_i: index of the block
+        :param files_list_path: path of the block's files list (one path per line, relative to the Data folder)
+        :return: exit code of the packer. 0 means success.
+        """
+        raise NotImplementedError()
+
+    def pack_many(self, blocks: List[int], files_list_paths: List[str]) -> int:
+        """
+        Packs several blocks, one after another, stopping at the first failure.
+        Backends that can pack several blocks with a single process override this.
+
+        :param blocks: indexes of the blocks
+        :param files_list_paths: path of each block's files list
+        :return: exit code of the packer. 0 means that all blocks have been packed.
+        """
+        for block_i, files_list_path in zip(blocks, files_list_paths):
+            exit_code = self.pack(block_i, files_list_path)
+            if exit_code != 0:
+                return exit_code
+        return 0
+
+    def cleanup(self) -> None:
+        """
+        Deletes any temporary file left by the packer, once all blocks have been packed and verified.
+        Called even if the build fails.
+        """
+        pass
+
+
+class ArchiveExeBackend(Backend):
+    """
+    Packs each block with Archive.exe, the packer included in the Creation Kit
+    """
+
+    name = "archive.exe"
+
+    def __init__(self, *args, archive_tool_path: str, **kwargs):
+        """
+        :param archive_tool_path: absolute path of the folder containing Archive.exe
+        """
+        super(ArchiveExeBackend, self).__init__(*args, **kwargs)
+        self.archive_tool_path = archive_tool_path
+
+    def script(self, blocks: List[int], log_name: str) -> List[str]:
+        """
+        Returns the lines of an Archive.exe script that packs some blocks,
+        with a "New Archive" ... "Save Archive" section for each block
+
+        :param blocks: indexes of the blocks
+        :param log_name: name of Archive.exe's log file
+        :return: lines of the script
+        """
+        lines = [f"Log: {log_name}"]
+        for block_i in blocks:
+            # TODO: Automatically determine CHECKs
+            lines.extend((
+                "New Archive",
+                "Check: Textures",
+                "Check: Meshes",
+                "Check: Voices",
+                "Check: Sounds",
+                "Check: Misc",
+                "Check: Compress Archive" if self.compress else "",
+                f"Set File Group Root: {self.data_path}{os.sep}",
+                f"Add File Group: {self.files_list_path(block_i)}",
+                f"Save Archive: {self.archive_path(block_i)}"
+            ))
+        return lines
+
+    def split_log(self, blocks: List[int], log_path: str) -> None:
+        """
+        Splits the log of a script that packed several blocks in a log for each block (log_{i}.txt).
+        Each block's log ends with the first line that mentions its archive,
+        any line after the last archive goes to the last block's log.
+
+        :param blocks: indexes of the blocks, in the same order as in the script
+        :param log_path: path of the log of the whole script
+        :return:
+        """
+        if not os.path.isfile(log_path):
+            return
+        with open(log_path, "r", errors="replace") as f:
+            lines = f.readlines()
+        start = 0
+        for n, block_i in enumerate(blocks):
+            end = len(lines)
+            if n < len(blocks) - 1:
+                archive_name = os.path.basename(self.archive_path(block_i)).lower()
+                end = next((j + 1 for j in range(start, len(lines)) if archive_name in lines[j].lower()), start)
+            with open(os.path.join(self.archive_tool_path, f"log_{block_i}.txt"), "w") as f:
+                f.writelines(lines[start:end])
+            start = end
+        os.remove(log_path)
+
+    def files_list_path(self, block_i: int) -> str:
+        return os.path.join(self.archive_tool_path, f"files_{block_i}.txt")
+
+    def pack(self, block_i: int, files_list_path: str) -> int:
+        return self.pack_many([block_i], [files_list_path])
+
+    def pack_many(self, blocks: List[int], files_list_paths: List[str]) -> int:
+        # A single Archive.exe run for all blocks
+        batch = len(blocks) > 1
+        log_name = f"log_batch_{blocks[0]}.txt" if batch else f"log_{blocks[0]}.txt"
+        script_name = f"script_{blocks[0]}.txt"
+        script_path = os.path.join(self.archive_tool_path, script_name)
+
+        # Write script
+        with open(script_path, "w") as f:
+            for x in self.script(blocks, log_name):
+                f.write(f"{x}\r\n")
+
+        # Copy the files lists, unless they've been written in the Archive.exe folder already
+        copies = []
+        for block_i, files_list_path in zip(blocks, files_list_paths):
+            tool_files_list_path = self.files_list_path(block_i)
+            if os.path.abspath(files_list_path) != os.path.abspath(tool_files_list_path):
+                shutil.copy(files_list_path, tool_files_list_path)
+                copies.append(tool_files_list_path)
+
+        # Execute Archive.exe, and provide it the script
+        try:
+            return subprocess.run(
+                [os.path.join(self.archive_tool_path, "Archive.exe"), script_name],
+                cwd=self.archive_tool_path
+            ).returncode
+        finally:
+            # Delete temp script and files lists
+            os.remove(script_path)
+            for tool_files_list_path in copies:
+                os.remove(tool_files_list_path)
+            if batch:
+                self.split_log(blocks, os.path.join(self.archive_tool_path, log_name))
+
+    def cleanup(self) -> None:
+        # Delete temp .bsl files left over by Archive.exe
+        print("* Deleting .bsl files")
+        if os.path.isdir(self.output_folder):
+            for file in os.listdir(self.output_folder):
+                if file.endswith(".bsl"):
+                    os.remove(os.path.join(self.output_folder, file))
+        # Delete the files lists written straight in the Archive.exe folder (see files_list_path()),
+        # including the ones of the blocks that have not been packed
+        if os.path.isdir(self.archive_tool_path):
+            for file in os.listdir(self.archive_tool_path):
+                if re.fullmatch(r"files_\d+\.txt", file):
+                    os.remove(os.path.join(self.archive_tool_path, file))
+
+
+class NativeBackend(Backend):
+    """
+    Packs each block with the Python BSA packer (bsa.py), in its own process.
+    Does not need Archive.exe, so it works on any OS.
+    """
+
+    name = "native"
+
+    def pack(self, block_i: int, files_list_path: str) -> int:
+        args = [
+            sys.executable, bsa.__file__,
+            "-i", self.data_path,
+            "-l", files_list_path,
+            "-o", self.archive_path(block_i),
+        ]
+        if self.compress:
+            args.append("-z")
+        return subprocess.run(args).returncode
+
+
+BACKENDS = {x.name: x for x in (ArchiveExeBackend, NativeBackend)}
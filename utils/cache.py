@@ -0,0 +1,106 @@
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Set, Tuple
+
+from utils.files import File
+
+
+def _to_signed(x: int) -> int:
+    # SQLite integers are signed 64 bit, xxh64 digests are unsigned
+    return x - (1 << 64) if x >= 1 << 63 else x
+
+
+def _to_unsigned(x: int) -> int:
+    return x + (1 << 64) if x < 0 else x
+
+
+class HashCache:
+    """
+    Persistent cache of the files' xxhashes, stored in a SQLite database.
+    Each entry is keyed on the file's path and stores its size and modification time,
+    if either of them changes the entry is considered invalid and the file is hashed again.
+    """
+
+    FILE_NAME = "pigroman_cache.sqlite3"
+    SCHEMA_VERSION = 1
+
+    def __init__(self, db_path: str):
+        """
+        Opens (or creates) a cache database and loads its entries
+
+        :param db_path: path of the SQLite database
+        """
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        if self.connection.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA_VERSION:
+            # Old or new database, (re)create it from scratch
+            with self.connection:
+                self.connection.execute("DROP TABLE IF EXISTS files")
+                self.connection.execute(
+                    "CREATE TABLE files ("
+                    "path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash INTEGER NOT NULL"
+                    ") WITHOUT ROWID"
+                )
+                self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+        # path -> (size, mtime_ns, hash)
+        self._entries: Dict[str, Tuple[int, int, int]] = {
+            path: (size, mtime_ns, _to_unsigned(hash_))
+            for path, size, mtime_ns, hash_ in self.connection.execute("SELECT path, size, mtime_ns, hash FROM files")
+        }
+        self._seen: Set[str] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def apply(self, file: File) -> bool:
+        """
+        Sets the hash of a File from the cache, if the file hasn't changed since it was cached.
+
+        :param file: File object
+        :return: True if the cached hash was valid and has been applied, False otherwise
+        """
+        path = file.path
+        self._seen.add(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == file.size and entry[1] == file.mtime_ns:
+            file.hash = entry[2]
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def save(self, files: Iterable[File], roots: List[str]) -> int:
+        """
+        Stores the hashes of the specified files and removes the entries of the
+        files inside `roots` that have not been seen since this cache was opened
+        (because they have been deleted or ignored).
+
+        :param files: File objects to cache. Files that haven't been hashed are skipped.
+        :param roots: absolute paths of the scanned folders
+        :return: number of pruned entries
+        """
+        updated = []
+        for file in files:
+            if not file.has_hash:
+                continue
+            path = file.path
+            entry = (file.size, file.mtime_ns, file.hash)
+            if self._entries.get(path) != entry:
+                self._entries[path] = entry
+                updated.append((path, file.size, file.mtime_ns, _to_signed(file.hash)))
+        # Only the entries inside the roots, not the ones in sibling folders with the same prefix (textures_hd)
+        roots = tuple(x.rstrip(os.sep) for x in roots)
+        prefixes = tuple(f"{x}{os.sep}" for x in roots)
+        deleted = [
+            path for path in self._entries
+            if path not in self._seen and (path.startswith(prefixes) or path in roots)
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)", updated)
+            self.connection.executemany("DELETE FROM files WHERE path = ?", ((x,) for x in deleted))
+        for path in deleted:
+            del self._entries[path]
+        return len(deleted)
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,203 @@
+from collections import defaultdict, deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+import xxhash
+
+from utils.files import File
+from utils.hashing import file_hash
+
+# Number of bytes hashed at the beginning and at the end of a file by partial_hash
+PARTIAL_SIZE = 64 * 1024
+
+
+def partial_hash(path: str, size: int, partial_size: int = PARTIAL_SIZE) -> int:
+    """
+    Computes the xxhash (xxh64) of the first and last partial_size bytes of a file.
+    Files with different partial hashes are different, files with the same
+    partial hash must be hashed entirely to find out if they're identical.
+
+    :param path: path of the file
+    :param size: size of the file. Must be bigger than 2 * partial_size.
+    :param partial_size: number of bytes hashed at each end of the file
+    :return: the xxh64 digest, as an int
+    """
+    h = xxhash.xxh64()
+    with open(path, "rb", buffering=0) as f:
+        h.update(f.read(partial_size))
+        f.seek(size - partial_size)
+        h.update(f.read(partial_size))
+    return h.intdigest()
+
+
+class TieredDeduplicator:
+    """
+    Finds identical files while reading as little data as possible:
+
+    * Files with a unique size can't have duplicates, so they're not read at all
+    * Files bigger than 2 * PARTIAL_SIZE with the same size are told apart by the hash of their
+      first and last PARTIAL_SIZE bytes
+    * Only files with the same size and the same partial hash (and small files with the same size)
+      are hashed entirely, and grouped by their full hash
+
+    Files whose hash is already known (eg: from the hash cache) are never read.
+    The groups are the same as the ones found by hashing every file entirely.
+
+    Files can be added while they're being scanned (add()): a file is hashed as soon as
+    another file with the same size (or the same partial hash) shows up.
+    With more than one worker, the hashes are computed by a pool of threads (or processes),
+    with a bounded number of pending hashes, so the scanner is paused if the hashing can't keep up.
+    The groups don't depend on the order in which the hashes are computed.
+    """
+
+    def __init__(self, partial_size: int = PARTIAL_SIZE, workers: int = 1, use_processes: bool = False):
+        """
+        :param partial_size: number of bytes hashed at each end of a file by the partial hash
+        :param workers: number of files hashed at the same time. 1 hashes the files in the calling thread.
+        :param use_processes: if True, the files are hashed by a process pool instead of a thread pool
+        """
+        self.partial_size = partial_size
+        self.workers = workers
+        self.use_processes = use_processes
+        self._executor: Optional[Executor] = None
+        self._reset()
+
+    def _reset(self) -> None:
+        # size -> files with that size, in the order they've been added
+        self._same_size: Dict[int, List[File]] = defaultdict(list)
+        # sizes with at least a file whose hash was already known
+        self._known_sizes: Set[int] = set()
+        # (size, partial hash) -> files
+        self._same_partial_hash: Dict[Tuple[int, int], List[File]] = defaultdict(list)
+        self._full_hash_requested: Set[File] = set()
+        self._pending: Deque[Tuple[Future, File, bool]] = deque()
+
+        # Stats
+        self.bytes_read = 0
+        self.full_hash_bytes = 0
+        self.partial_hashes = 0
+        self.full_hashes = 0
+
+    def __enter__(self) -> "TieredDeduplicator":
+        if self.workers > 1:
+            pool = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            self._executor = pool(max_workers=self.workers)
+        return self
+
+    def __exit__(self, *_) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _submit(self, file: File, full: bool) -> None:
+        """
+        Computes the full or partial hash of a file, in the pool if there's one
+
+        :param file: the file
+        :param full: True to hash the whole file, False to compute its partial hash
+        :return:
+        """
+        if full:
+            self.full_hashes += 1
+            self.bytes_read += file.size
+            func: Callable = file_hash
+            args: tuple = (file.path,)
+        else:
+            self.partial_hashes += 1
+            self.bytes_read += 2 * self.partial_size
+            func = partial_hash
+            args = (file.path, file.size, self.partial_size)
+        if self._executor is None:
+            self._on_hash(file, full, func(*args))
+            return
+        self._pending.append((self._executor.submit(func, *args), file, full))
+        # Bounded queue of pending hashes
+        while len(self._pending) > self.workers * 4:
+            self._complete_oldest()
+
+    def _complete_oldest(self) -> None:
+        future, file, full = self._pending.popleft()
+        self._on_hash(file, full, future.result())
+
+    def _request_full_hash(self, file: File) -> None:
+        if file.has_hash or file in self._full_hash_requested:
+            return
+        self._full_hash_requested.add(file)
+        self._submit(file, full=True)
+
+    def _request_hash(self, file: File) -> None:
+        """
+        Requests the hash needed to tell a file apart from the other files with the same size
+        """
+        if file.size <= 2 * self.partial_size or file.size in self._known_sizes:
+            # Small files are hashed entirely, as the partial hash would read them entirely anyway.
+            # Files with the same size as a file with a known hash can only be compared by full hash.
+            self._request_full_hash(file)
+        elif not file.has_hash:
+            self._submit(file, full=False)
+
+    def _on_hash(self, file: File, full: bool, h: int) -> None:
+        if full:
+            file.hash = h
+            return
+        group = self._same_partial_hash[(file.size, h)]
+        group.append(file)
+        if file.size in self._known_sizes or len(group) == 2:
+            for x in group:
+                self._request_full_hash(x)
+        elif len(group) > 2:
+            self._request_full_hash(file)
+
+    def add(self, file: File) -> None:
+        """
+        Adds a file. Its hash might be computed later, in the pool.
+
+        :param file: the file
+        :return:
+        """
+        if not file.has_hash:
+            # Bytes that would have been read by hashing every file entirely
+            self.full_hash_bytes += file.size
+        same_size = self._same_size[file.size]
+        same_size.append(file)
+        if file.has_hash and file.size not in self._known_sizes:
+            self._known_sizes.add(file.size)
+            if len(same_size) > 1:
+                # All the other files with this size must be hashed entirely to be compared with this one
+                for x in same_size:
+                    self._request_full_hash(x)
+                return
+        if len(same_size) == 2:
+            for x in same_size:
+                self._request_hash(x)
+        elif len(same_size) > 2:
+            self._request_hash(file)
+
+    def result(self) -> Dict[int, Set[File]]:
+        """
+        Waits for all pending hashes and returns the groups of identical files.
+        The groups (and their order) only depend on the files and the order they've been added in.
+
+        :return: xxhash -> set of identical 'File's. Only groups of at least two files are returned.
+        """
+        while self._pending:
+            self._complete_oldest()
+        duplicates: Dict[int, Set[File]] = defaultdict(set)
+        for files in self._same_size.values():
+            for file in files:
+                if file.has_hash and len(files) > 1:
+                    duplicates[file.hash].add(file)
+        return {k: v for k, v in duplicates.items() if len(v) > 1}
+
+    def find(self, files: Iterable[File]) -> Dict[int, Set[File]]:
+        """
+        Finds the groups of identical files
+
+        :param files: File objects
+        :return: xxhash -> set of identical 'File's. Only groups of at least two files are returned.
+        """
+        self._reset()
+        with self:
+            for file in files:
+                self.add(file)
+            return self.result()
@@ -0,0 +1,105 @@
+import os
+import sys
+from collections import namedtuple
+from typing import Optional
+
+from utils.hashing import file_hash
+
+
+# Number of files, total size and total estimated size (see File.estimated_size) of a block's files list
+ListSize = namedtuple("ListSize", "files_count size estimated_size")
+
+
+def is_ascii(s: str) -> bool:
+    """
+    A function that checks whether a string contains
+    only ASCII characters
+
+    :param s: input string
+    :return: True if it contains only ASCII characters, False otherwise.
+    """
+    return all(ord(c) < 128 for c in s)
+
+
+class File:
+    """
+    A class representing a file that will be packet.
+    Million-file Data folders create millions of these, so they're kept small: no instance dict,
+    the base dir and the folder names are shared by all the files (interned),
+    and the absolute path is built only when it's needed.
+    """
+
+    __slots__ = ("base_dir", "folder", "name", "size", "estimated_size", "mtime_ns", "copied", "_hash")
+
+    def __init__(self, path: str, base_dir: str, size: int, mtime_ns: int = 0):
+        """
+        Initializes a new File object
+
+        :param path: absolute path of the file, as it is on disk. It's lower cased only inside the archives,
+                     so it works on case-sensitive file systems too.
+        :param base_dir: absolute base (Data) path
+        :param size: size of the file, in bytes
+        :param mtime_ns: last modification time of the file, in nanoseconds
+        """
+        path = path.strip()
+        base_dir = base_dir.strip()
+        if not os.path.normcase(path).startswith(os.path.normcase(base_dir)):
+            raise RuntimeError(f"The files must be in the base dir ({path}, base dir is {base_dir})")
+        folder, _, self.name = path[len(base_dir):].lstrip(os.sep).strip().rpartition(os.sep)
+        self.base_dir = sys.intern(base_dir)
+        # Relative path of the folder, shared by all the files in the same folder
+        self.folder = sys.intern(folder)
+        self.size = size
+        # Size of the file in the archive, used to split the files in blocks. Lower than size if compressed.
+        self.estimated_size = size
+        self.mtime_ns = mtime_ns
+        self.copied = False
+        self._hash: Optional[int] = None
+
+    @property
+    def relative_path(self) -> str:
+        """
+        Returns this file's path, relative to the "Data" folder
+
+        :return:
+        """
+        return f"{self.folder}{os.sep}{self.name}" if self.folder else self.name
+
+    @property
+    def path(self) -> str:
+        """
+        Returns this file's absolute path, as it is on disk
+
+        :return:
+        """
+        return f"{self.base_dir}{os.sep}{self.relative_path}"
+
+    @property
+    def hash(self) -> int:
+        """
+        xxhash of the file, computed the first time it's needed.
+        The file is hashed in chunks, so it's never loaded entirely in memory.
+
+        :return:
+        """
+        if self._hash is None:
+            self._hash = file_hash(self.path)
+        return self._hash
+
+    @hash.setter
+    def hash(self, value: int) -> None:
+        self._hash = value
+
+    @property
+    def has_hash(self) -> bool:
+        """
+        :return: True if the hash of this file is known, so reading `hash` doesn't read the file
+        """
+        return self._hash is not None
+
+    def __repr__(self) -> str:
+        return f"<File {self.path} [{self.hash}]>"
+
+    @property
+    def cli_format(self):
+        return f"{self.relative_path}\n"
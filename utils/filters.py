@@ -0,0 +1,204 @@
+import os
+import re
+from fnmatch import translate
+from typing import Dict, Iterable, List, Optional
+
+
+class Rule:
+    """
+    A filter rule, with the number of files and folders it skipped in the last scan
+    """
+
+    def __init__(self, description: str):
+        """
+        :param description: description of the rule, printed in the report
+        """
+        self.description = description
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self.skipped_folders = 0
+
+
+def normalize(path: str) -> str:
+    """
+    :param path: a path or a glob pattern, with slashes or backslashes
+    :return: the path, lower case and with forward slashes
+    """
+    return path.lower().replace("\\", "/").strip("/")
+
+
+class FileFilter:
+    """
+    Decides which files of the "Data" folder are packed. The rules are compiled once:
+
+    * Excluded folders are stored in a trie of path components, so checking a folder costs one dict lookup
+      per component. Excluded folders are never listed, so excluding a big folder costs nothing.
+    * Include and exclude globs are merged in a single regular expression each.
+      Globs without a slash match the file name, globs with a slash match the path relative to the Data folder.
+    * Extensions are looked up in sets, sizes are compared with a range.
+
+    A file is packed if no exclude rule matches it, and it matches all the include rules that have been specified.
+    Each rule counts the files it skipped. Folders are skipped only by the excluded folders.
+    """
+
+    def __init__(
+        self, data_path: str, exclude_folders: Iterable[str] = (), include_globs: Iterable[str] = (),
+        exclude_globs: Iterable[str] = (), include_extensions: Iterable[str] = (),
+        exclude_extensions: Iterable[str] = (), min_size: Optional[int] = None, max_size: Optional[int] = None
+    ):
+        """
+        :param data_path: absolute path of the "Data" folder
+        :param exclude_folders: absolute paths (or paths relative to the Data folder) of the folders to skip
+        :param include_globs: if any, only the files that match at least one of them are packed
+        :param exclude_globs: files that match any of them are skipped
+        :param include_extensions: if any, only the files with one of these extensions are packed
+        :param exclude_extensions: files with one of these extensions are skipped
+        :param min_size: files smaller than this, in bytes, are skipped
+        :param max_size: files bigger than this, in bytes, are skipped
+        """
+        self.data_path = normalize(data_path)
+        self.rules: List[Rule] = []
+
+        # Trie of the excluded folders' components. The rule is stored under the None key of its last component.
+        self._folders: Dict[Optional[str], dict] = {}
+        for folder in exclude_folders:
+            relative = normalize(folder)
+            if relative.startswith(self.data_path + "/"):
+                relative = relative[len(self.data_path) + 1:]
+            node = self._folders
+            for component in relative.split("/"):
+                node = node.setdefault(component, {})
+            node[None] = self._add_rule(f"not folder {folder}")
+
+        self._include_globs, self._include_globs_rule = self._compile_globs(include_globs, "include")
+        self._exclude_globs, self._exclude_globs_rules = self._compile_globs(exclude_globs, "exclude")
+
+        self._include_extensions = frozenset(self._extension(x) for x in include_extensions)
+        self._include_extensions_rule = self._add_rule(
+            f"extension not in {', '.join(sorted(self._include_extensions))}"
+        ) if self._include_extensions else None
+        self._exclude_extensions: Dict[str, Rule] = {
+            x: self._add_rule(f"extension {x}") for x in (self._extension(y) for y in exclude_extensions)
+        }
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self._min_size_rule = self._add_rule(f"smaller than {min_size} bytes") if min_size is not None else None
+        self._max_size_rule = self._add_rule(f"bigger than {max_size} bytes") if max_size is not None else None
+
+        # Files are checked only if there's at least a file rule
+        self.checks_files = any((
+            self._include_globs, self._exclude_globs, self._include_extensions, self._exclude_extensions,
+            min_size is not None, max_size is not None
+        ))
+
+    @staticmethod
+    def _extension(extension: str) -> str:
+        extension = extension.strip().lower()
+        return extension if extension.startswith(".") else f".{extension}"
+
+    def _add_rule(self, description: str) -> Rule:
+        rule = Rule(description)
+        self.rules.append(rule)
+        return rule
+
+    def _compile_globs(self, globs: Iterable[str], kind: str):
+        """
+        Merges some globs in a single regular expression, with a named group for each glob
+
+        :param globs: glob patterns
+        :param kind: "include" or "exclude"
+        :return: (compiled regular expression or None if there are no globs, rules).
+                 Include globs have a single rule, exclude globs have a rule for each glob.
+        """
+        globs = [normalize(x) for x in globs]
+        if not globs:
+            return None, None
+        groups = []
+        for i, glob in enumerate(globs):
+            # Globs without a slash match the file name only
+            prefix = "" if "/" in glob else "(?:.*/)?"
+            groups.append(f"(?P<rule{i}>{prefix}{translate(glob)})")
+        pattern = re.compile("|".join(groups))
+        if kind == "include":
+            return pattern, self._add_rule(f"not matching {', '.join(globs)}")
+        return pattern, [self._add_rule(f"matching {x}") for x in globs]
+
+    def relative_path(self, path: str) -> str:
+        """
+        :param path: absolute path of a file or folder inside the Data folder
+        :return: the path relative to the Data folder, lower case and with forward slashes
+        """
+        return normalize(path)[len(self.data_path) + 1:]
+
+    def skip_folder(self, path: str) -> Optional[Rule]:
+        """
+        Checks whether a folder must be skipped, without listing it. Updates the rule's counter.
+
+        :param path: absolute path of the folder
+        :return: the rule that skips the folder, or None if it must be scanned
+        """
+        if not self._folders:
+            return None
+        node = self._folders
+        for component in self.relative_path(path).split("/"):
+            node = node.get(component)
+            if node is None:
+                return None
+            rule = node.get(None)
+            if rule is not None:
+                rule.skipped_folders += 1
+                return rule
+        return None
+
+    def skip_file(self, path: str, size: int) -> Optional[Rule]:
+        """
+        Checks whether a file must be skipped. Updates the rule's counters.
+
+        :param path: absolute path of the file
+        :param size: size of the file, in bytes
+        :return: the rule that skips the file, or None if it must be packed
+        """
+        if not self.checks_files:
+            return None
+        rule = self._match(path, size)
+        if rule is not None:
+            rule.skipped_files += 1
+            rule.skipped_bytes += size
+        return rule
+
+    def _match(self, path: str, size: int) -> Optional[Rule]:
+        if self._min_size_rule is not None and size < self.min_size:
+            return self._min_size_rule
+        if self._max_size_rule is not None and size > self.max_size:
+            return self._max_size_rule
+        if self._include_extensions or self._exclude_extensions:
+            extension = os.path.splitext(path)[1].lower()
+            if self._include_extensions and extension not in self._include_extensions:
+                return self._include_extensions_rule
+            rule = self._exclude_extensions.get(extension)
+            if rule is not None:
+                return rule
+        if self._include_globs is not None or self._exclude_globs is not None:
+            relative_path = self.relative_path(path)
+            if self._include_globs is not None and self._include_globs.match(relative_path) is None:
+                return self._include_globs_rule
+            if self._exclude_globs is not None:
+                match = self._exclude_globs.match(relative_path)
+                if match is not None:
+                    i = next(k for k, v in match.groupdict().items() if k.startswith("rule") and v is not None)
+                    return self._exclude_globs_rules[int(i[len("rule"):])]
+        return None
+
+    def print_report(self) -> None:
+        """
+        Prints how many files and folders each rule skipped in the last scan
+        """
+        for rule in self.rules:
+            if rule.skipped_folders:
+                print(f"* Filter '{rule.description}': {rule.skipped_folders} folders not scanned")
+            else:
+                print(
+                    f"* Filter '{rule.description}': {rule.skipped_files} files "
+                    f"({rule.skipped_bytes / 1024 / 1024:.1f} MB) skipped"
+                )
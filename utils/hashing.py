@@ -0,0 +1,27 @@
+import xxhash
+
+# Max number of bytes read at once while hashing a file
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_hash(path: str, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    Computes the xxhash (xxh64) of a file without loading it in memory.
+    The file is read in chunks into a single preallocated buffer, so at most
+    `chunk_size` bytes are held in memory, no matter how big the file is.
+    The result is the same as xxhash.xxh64_intdigest(f.read()).
+
+    :param path: path of the file to hash
+    :param chunk_size: size, in bytes, of the read buffer
+    :return: the xxh64 digest, as an int
+    """
+    h = xxhash.xxh64()
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.intdigest()
@@ -0,0 +1,153 @@
+import json
+import sys
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Any, Dict, Iterator, List, Optional, TextIO
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Returns the peak resident set size of this process and of its terminated child processes (packers),
+    in bytes, if the OS supports it
+
+    :return: peak RSS in bytes, or None if it's not available
+    """
+    if resource is None:
+        return None
+    # ru_maxrss is in bytes on macOS, in kilobytes everywhere else
+    unit = 1 if sys.platform == "darwin" else 1024
+    return max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    ) * unit
+
+
+class Phase:
+    """
+    Timer and counters of a single phase of the build (or of a single block)
+    """
+
+    __slots__ = ("name", "seconds", "files", "bytes", "extra", "started")
+
+    def __init__(self, name: str, files: int = 0, bytes_: int = 0):
+        """
+        :param name: name of the phase
+        :param files: number of files processed by the phase. Can also be updated while the phase is running.
+        :param bytes_: number of bytes processed by the phase. Can also be updated while the phase is running.
+        """
+        self.name = name
+        self.seconds = 0.0
+        self.files = files
+        self.bytes = bytes_
+        self.extra: Dict[str, Any] = {}
+        self.started = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.seconds if self.seconds > 0 else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "phase": self.name,
+            "seconds": self.seconds,
+            "files": self.files,
+            "bytes": self.bytes,
+            "files_per_second": self.files_per_second,
+            "bytes_per_second": self.bytes_per_second,
+            **self.extra
+        }
+
+
+class Metrics:
+    """
+    Collects the timers and counters of each phase of a build.
+    Each finished phase is written as a JSON line to the output file (if any),
+    and all phases can be printed as a table at the end of the build.
+    Phases can be recorded from multiple threads.
+    """
+
+    def __init__(self, output: Optional[TextIO] = None):
+        """
+        :param output: text file where the JSON lines are written. If None, the metrics are only kept in memory.
+        """
+        self.output = output
+        self.phases: List[Phase] = []
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str, files: int = 0, bytes_: int = 0) -> Iterator[Phase]:
+        """
+        Times a phase. The counters of the yielded Phase can be updated while the phase is running.
+
+        :param name: name of the phase
+        :param files: number of files processed by the phase, if already known
+        :param bytes_: number of bytes processed by the phase, if already known
+        :return: the Phase
+        """
+        phase = self.start(name, files, bytes_)
+        try:
+            yield phase
+        finally:
+            self.stop(phase)
+
+    def start(self, name: str, files: int = 0, bytes_: int = 0) -> Phase:
+        """
+        Starts timing a phase that doesn't fit in a with block. Must be followed by stop().
+
+        :param name: name of the phase
+        :param files: number of files processed by the phase, if already known
+        :param bytes_: number of bytes processed by the phase, if already known
+        :return: the Phase
+        """
+        phase = Phase(name, files, bytes_)
+        phase.started = time.monotonic()
+        return phase
+
+    def stop(self, phase: Phase) -> None:
+        """
+        Stops timing a phase started with start(), and records it
+
+        :param phase: the phase
+        :return:
+        """
+        phase.seconds = time.monotonic() - phase.started
+        self.record(phase)
+
+    def record(self, phase: Phase) -> None:
+        """
+        Stores a finished phase, and writes it to the output file
+
+        :param phase: the finished phase
+        :return:
+        """
+        with self._lock:
+            self.phases.append(phase)
+            if self.output is not None:
+                self.output.write(json.dumps({"time": time.time(), "peak_rss": peak_rss(), **phase.to_dict()}))
+                self.output.write("\n")
+                self.output.flush()
+
+    def print_summary(self) -> None:
+        """
+        Prints a table with the timers and counters of each phase
+        """
+        print(f"\n{'phase':<16} {'time (s)':>10} {'files':>10} {'MB':>10} {'files/s':>10} {'MB/s':>10}")
+        for phase in self.phases:
+            print(
+                f"{phase.name:<16} {phase.seconds:>10.2f} {phase.files:>10} {phase.bytes / 1024 / 1024:>10.1f} "
+                f"{phase.files_per_second:>10.0f} {phase.bytes_per_second / 1024 / 1024:>10.1f}"
+            )
+        rss = peak_rss()
+        if rss is not None:
+            print(f"Peak RSS: {rss / 1024 / 1024:.0f} MB")
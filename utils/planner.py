@@ -0,0 +1,477 @@
+import heapq
+import json
+import os
+from abc import ABC, abstractmethod
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+from utils.files import File
+
+
+class Planner(ABC):
+    """
+    Splits the scanned files in blocks. Each block becomes an archive.
+    Block sizes are computed from File.estimated_size, the size that a file takes in the archive.
+    Blocks refer to the files by their index in the list of scanned files, stored in a range
+    or in an array, so they take at most 8 bytes per file.
+    """
+
+    def __init__(self, max_block_size: int):
+        """
+        :param max_block_size: max size, in bytes, of each block
+        """
+        self.max_block_size = max_block_size
+        # Indexes of the archives of the previous run that no longer have any file, set by plan()
+        self.stale_blocks: List[int] = []
+
+    @abstractmethod
+    def plan(self, files: List[File]) -> List[Sequence[int]]:
+        """
+        Splits the files in blocks
+
+        :param files: File objects, in scan order
+        :return: list of blocks. Each block is a sequence of indexes in files.
+        """
+        raise NotImplementedError()
+
+    def save(self, blocks: List[Sequence[int]], files: List[File]) -> None:
+        """
+        Called once all blocks have been packed. Planners that keep a state between runs store it here.
+
+        :param blocks: list of blocks
+        :param files: File objects, in scan order
+        :return:
+        """
+        pass
+
+
+class GreedyPlanner(Planner):
+    """
+    Adds the files to a block, in scan order, until the block reaches the max size.
+    If the last block is smaller than 1/4 of the max size, it's merged with the
+    second last one, so the last archive can be up to 1/4 bigger than the max size.
+
+    The files can also be added one at a time while they're being scanned (add() and finish()),
+    so each block can be packed while the next ones are still being scanned.
+    """
+
+    def __init__(self, max_block_size: int):
+        super(GreedyPlanner, self).__init__(max_block_size)
+        self.blocks: List[range] = []
+        self._reset()
+
+    def _reset(self) -> None:
+        # Each block is a range of consecutive files
+        self.blocks = []
+        self._files_count = 0
+        self._start = 0
+        self._block_size = 0
+        # Last full block. It's not final until the next block is full, as the last files could be merged in it.
+        self._held: Optional[range] = None
+
+    def add(self, file: File) -> Optional[range]:
+        """
+        Adds the next file in scan order
+
+        :param file: the file
+        :return: a block that won't change anymore, if there's one
+        """
+        self._files_count += 1
+        self._block_size += file.estimated_size
+        if self._block_size < self.max_block_size:
+            return None
+
+        # Block exceeded max size, create a permanent new block
+        ready, self._held = self._held, range(self._start, self._files_count)
+        self._start = self._files_count
+        self._block_size = 0
+        if ready is not None:
+            self.blocks.append(ready)
+        return ready
+
+    def finish(self) -> List[range]:
+        """
+        Makes the last blocks permanent, once all files have been added
+
+        :return: the blocks that haven't been returned by add() yet
+        """
+        last = []
+        if self._held is not None:
+            last.append(self._held)
+        # Make the last local block permanent
+        # Or add the files in the local block to the last permanent block if they're few
+        if self._start < self._files_count:
+            if self._block_size < self.max_block_size / 4 and last:
+                last[-1] = range(last[-1].start, self._files_count)
+            else:
+                last.append(range(self._start, self._files_count))
+        self._held = None
+        self._start = self._files_count
+        self._block_size = 0
+        self.blocks.extend(last)
+        return last
+
+    def plan(self, files: List[File]) -> List[Sequence[int]]:
+        self._reset()
+        for file in files:
+            self.add(file)
+        self.finish()
+        return self.blocks
+
+
+class StablePlanner(Planner):
+    """
+    Keeps each file in the same block it was assigned to in the previous run,
+    so adding, removing or editing a few files changes only a few archives.
+    The layout of the previous run is stored in a JSON file in the output folder.
+
+    * Files that no longer exist are removed from their block
+    * If a block grew over the max size, its last files are moved out of it
+    * New (and moved) files are added to a block that already contains files from
+      the same folder, or to the last block, if they fit. Otherwise, a new block is created.
+    * Blocks whose files have all been removed keep their index (and archive name), so the following
+      blocks keep theirs. They're reused for new files, and dropped only at the end of the list.
+      Their archives are listed in stale_blocks.
+
+    Every block stays within the max size, unless it contains a single file bigger than that.
+    The layout is saved only once the blocks have been packed (save()), so a failed build doesn't
+    become the baseline of the next run.
+    """
+
+    FILE_NAME = "pigroman_blocks.json"
+
+    def __init__(self, max_block_size: int, state_path: str):
+        """
+        :param max_block_size: max size, in bytes, of each block
+        :param state_path: path of the JSON file containing the layout of the previous run
+        """
+        super(StablePlanner, self).__init__(max_block_size)
+        self.state_path = state_path
+
+    def load(self) -> List[List[str]]:
+        """
+        Loads the layout of the previous run
+
+        :return: list of blocks. Each block is a list of relative paths.
+        """
+        if not os.path.isfile(self.state_path):
+            return []
+        with open(self.state_path, "r") as f:
+            return json.loads(f.read())["blocks"]
+
+    def save(self, blocks: List[Sequence[int]], files: List[File]) -> None:
+        """
+        Saves the layout of this run, so it can be reused by the next one.
+        Must be called only once all blocks have been packed.
+
+        :param blocks: list of blocks
+        :param files: File objects, in scan order
+        :return:
+        """
+        with open(self.state_path, "w") as f:
+            f.write(json.dumps({
+                "max_block_size": self.max_block_size,
+                "blocks": [[files[x].relative_path for x in block] for block in blocks]
+            }))
+
+    def plan(self, files: List[File]) -> List[Sequence[int]]:
+        previous = self.load()
+        # relative path -> index in files
+        by_path: Dict[str, int] = {x.relative_path: i for i, x in enumerate(files)}
+        blocks: List[List[int]] = []
+        sizes: List[int] = []
+        assigned = set()
+
+        # Put the files back in their previous block
+        for old_block in previous:
+            block = []
+            size = 0
+            for path in old_block:
+                i = by_path.get(path)
+                if i is None or path in assigned:
+                    continue
+                block.append(i)
+                assigned.add(path)
+                size += files[i].estimated_size
+
+            # Move the last files out of the block if it's too big now
+            while size > self.max_block_size and len(block) > 1:
+                evicted = files[block.pop()]
+                assigned.remove(evicted.relative_path)
+                size -= evicted.estimated_size
+            blocks.append(block)
+            sizes.append(size)
+
+        # folder -> index of a block that contains files from that folder
+        folder_blocks: Dict[str, int] = {}
+        for i, block in enumerate(blocks):
+            for file_i in block:
+                folder_blocks[files[file_i].folder] = i
+
+        def fits(block_i: Optional[int], file_: File) -> bool:
+            return block_i is not None and (
+                not blocks[block_i] or sizes[block_i] + file_.estimated_size <= self.max_block_size
+            )
+
+        # Add new files
+        for i, file in enumerate(files):
+            if file.relative_path in assigned:
+                continue
+            folder = file.folder
+            target = folder_blocks.get(folder)
+            if not fits(target, file):
+                # Reuse blocks whose files have all been removed, if there are any
+                target = next((i for i, x in enumerate(blocks) if not x), len(blocks) - 1 if blocks else None)
+            if not fits(target, file):
+                blocks.append([])
+                sizes.append(0)
+                target = len(blocks) - 1
+            blocks[target].append(i)
+            sizes[target] += file.estimated_size
+            assigned.add(file.relative_path)
+            folder_blocks[folder] = target
+
+        # Blocks that are still empty keep their index, so the archives after them are not renamed.
+        # Only the empty blocks at the end are dropped.
+        while blocks and not blocks[-1]:
+            blocks.pop()
+        self.stale_blocks = [i for i, x in enumerate(blocks) if not x] + list(range(len(blocks), len(previous)))
+        blocks = [array("l", x) for x in blocks]
+
+        # Report how many archives changed since the last run
+        changed = sum(
+            1 for i, block in enumerate(blocks)
+            if i >= len(previous) or [files[x].relative_path for x in block] != previous[i]
+        )
+        print(
+            f"+ Stable layout: {len(blocks)} blocks, {changed} changed since the last run, "
+            f"{len(self.stale_blocks)} archives to delete"
+        )
+        return blocks
+
+
+def first_fit_decreasing(sizes: List[int], cap: int) -> List[List[int]]:
+    """
+    Sorts the items by size, biggest first, and adds each item to the first bin
+    that has enough free space for it. Items bigger than `cap` get their own bin.
+
+    Free space is tracked with a segment tree (max free space per range of bins),
+    so finding the first bin that fits takes O(log(bins)).
+
+    :param sizes: size of each item
+    :param cap: max size of each bin
+    :return: list of bins. Each bin is a list of item indices, sorted.
+    """
+    bins: List[List[int]] = []
+
+    # Items bigger than max size get their own bin
+    small = []
+    for i, size in enumerate(sizes):
+        if size > cap:
+            bins.append([i])
+        else:
+            small.append(i)
+    small.sort(key=sizes.__getitem__, reverse=True)
+
+    # First fit never leaves two bins half empty, so it never needs more than that
+    max_bins = 2 * ((sum(sizes[x] for x in small) + cap - 1) // cap) + 1
+    leaves = 1
+    while leaves < max_bins:
+        leaves *= 2
+    tree = [cap] * (2 * leaves)
+    fitted: List[List[int]] = []
+    for i in small:
+        size = sizes[i]
+        # Find the leftmost bin with enough free space
+        node = 1
+        while node < leaves:
+            node *= 2
+            if tree[node] < size:
+                node += 1
+        bin_i = node - leaves
+        if bin_i == len(fitted):
+            fitted.append([])
+        fitted[bin_i].append(i)
+
+        # Update the free space of the bin and its parents, stop as soon as a parent doesn't change
+        tree[node] -= size
+        node //= 2
+        while node:
+            left = tree[2 * node]
+            right = tree[2 * node + 1]
+            free = left if left > right else right
+            if tree[node] == free:
+                break
+            tree[node] = free
+            node //= 2
+    bins.extend(fitted)
+    return [sorted(x) for x in bins]
+
+
+class FirstFitDecreasingPlanner(Planner):
+    """
+    Sorts the files by size, biggest first, and adds each file to the
+    first block that has enough free space for it.
+    A heuristic that produces close to the fewest archives (never more than about 11/9 of the optimum),
+    but files from the same folder can end up in different archives.
+    """
+
+    def plan(self, files: List[File]) -> List[Sequence[int]]:
+        bins = first_fit_decreasing([x.estimated_size for x in files], self.max_block_size)
+        return [array("l", x) for x in bins]
+
+
+class FolderPlanner(Planner):
+    """
+    Keeps the files of each folder in the same block, whenever possible.
+    Every folder in an archive costs a folder record and its name, so this keeps the
+    archives' headers small and the files of a folder close to each other.
+
+    Folders that fit in a block are packed as a whole (first fit decreasing).
+    Folders bigger than the max size are split in as few chunks as possible,
+    and each chunk is packed on its own.
+    """
+
+    def plan(self, files: List[File]) -> List[Sequence[int]]:
+        cap = self.max_block_size
+
+        # Group the files by folder, keeping the scan order
+        folders: Dict[str, List[int]] = {}
+        for i, file in enumerate(files):
+            folders.setdefault(file.folder, []).append(i)
+
+        # Split oversized folders in chunks
+        chunks: List[List[int]] = []
+        sizes: List[int] = []
+        for indices in folders.values():
+            chunk: List[int] = []
+            chunk_size = 0
+            for i in indices:
+                if chunk and chunk_size + files[i].estimated_size > cap:
+                    chunks.append(chunk)
+                    sizes.append(chunk_size)
+                    chunk = []
+                    chunk_size = 0
+                chunk.append(i)
+                chunk_size += files[i].estimated_size
+            chunks.append(chunk)
+            sizes.append(chunk_size)
+
+        bins = first_fit_decreasing(sizes, cap)
+        return [array("l", sorted(i for chunk_i in bin_ for i in chunks[chunk_i])) for bin_ in bins]
+
+
+class BalancedPlanner(Planner):
+    """
+    Uses close to the fewest archives and makes them all about the same size.
+    Files are sorted by size, biggest first, and each file is added to the smallest block
+    (LPT scheduling). If a block would exceed the max size, the files are split again
+    with one more block. Both are heuristics, so the number of archives is not guaranteed to be the minimum.
+    """
+
+    def plan(self, files: List[File]) -> List[Sequence[int]]:
+        cap = self.max_block_size
+        blocks: List[List[int]] = []
+        small = []
+        for i, file in enumerate(files):
+            if file.estimated_size > cap:
+                blocks.append([i])
+            else:
+                small.append(i)
+        small.sort(key=lambda x: files[x].estimated_size, reverse=True)
+
+        bins_count = max(1, (sum(files[x].estimated_size for x in small) + cap - 1) // cap)
+        while small:
+            bins: List[List[int]] = [[] for _ in range(bins_count)]
+            heap = [(0, x) for x in range(bins_count)]
+            ok = True
+            for i in small:
+                size, bin_i = heap[0]
+                if size + files[i].estimated_size > cap:
+                    ok = False
+                    break
+                bins[bin_i].append(i)
+                heapq.heapreplace(heap, (size + files[i].estimated_size, bin_i))
+            if ok:
+                blocks.extend(bins)
+                break
+            bins_count += 1
+        return [array("l", sorted(block)) for block in blocks]
+
+
+def fill_efficiency(blocks: List[Sequence[int]], files: List[File], max_block_size: int) -> float:
+    """
+    Returns how well the blocks fill the archives (total size / (number of blocks * max size))
+
+    :param blocks: list of blocks
+    :param files: File objects, in scan order
+    :param max_block_size: max size, in bytes, of each block
+    :return: fill efficiency, from 0 to 1. Can be > 1 if some blocks are bigger than the max size.
+    """
+    if not blocks:
+        return 0.0
+    return sum(files[x].estimated_size for block in blocks for x in block) / (len(blocks) * max_block_size)
+
+
+def folder_records(blocks: List[Sequence[int]], files: List[File]) -> int:
+    """
+    Returns the total number of folder records of the archives.
+    A folder that's split between two archives counts twice.
+
+    :param blocks: list of blocks
+    :param files: File objects, in scan order
+    :return: total number of folder records
+    """
+    return sum(len({files[x].folder for x in block}) for block in blocks)
+
+
+def print_report(blocks: List[Sequence[int]], files: List[File], max_block_size: int, planner_name: str) -> None:
+    """
+    Prints the size of each block, and compares the fill efficiency, the number
+    of archives and the number of folder records with the greedy planner
+
+    :param blocks: list of blocks created by the planner
+    :param files: File objects, in scan order
+    :param max_block_size: max size, in bytes, of each block
+    :param planner_name: name of the planner that created the blocks
+    :return:
+    """
+    for i, block in enumerate(blocks):
+        print(f"+ Block {i}: {len(block)} files, { sum(files[x].estimated_size for x in block) / 1024 / 1024 } MB")
+    print(
+        f"* Planner '{planner_name}': {len(blocks)} archives, "
+        f"{fill_efficiency(blocks, files, max_block_size) * 100:.1f}% fill efficiency, "
+        f"{folder_records(blocks, files)} folder records"
+    )
+    if planner_name != "greedy":
+        greedy_blocks = GreedyPlanner(max_block_size).plan(files)
+        print(
+            f"* Planner 'greedy' would have created {len(greedy_blocks)} archives, "
+            f"{fill_efficiency(greedy_blocks, files, max_block_size) * 100:.1f}% fill efficiency, "
+            f"{folder_records(greedy_blocks, files)} folder records"
+        )
+
+
+def get_planner(name: str, max_block_size: int, output_folder: str) -> Planner:
+    """
+    Creates a planner
+
+    :param name: name of the planner (one of PLANNERS)
+    :param max_block_size: max size, in bytes, of each block
+    :param output_folder: output folder, where the planners can store their state
+    :return: a Planner
+    """
+    if name not in PLANNERS:
+        raise ValueError(f"Unknown planner: {name}")
+    if name == "stable":
+        return StablePlanner(max_block_size, os.path.join(output_folder, StablePlanner.FILE_NAME))
+    return PLANNERS[name](max_block_size)
+
+
+PLANNERS = {
+    "greedy": GreedyPlanner,
+    "stable": StablePlanner,
+    "ffd": FirstFitDecreasingPlanner,
+    "balanced": BalancedPlanner,
+    "folders": FolderPlanner,
+}
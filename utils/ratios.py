@@ -0,0 +1,111 @@
+import json
+import os
+import random
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+import bsa
+from utils.files import File
+
+
+class CompressionRatios:
+    """
+    Estimates how big each file will be in a compressed archive, from the compression ratio of its extension.
+    The ratios are learnt from the archives created by the previous runs, and saved in a JSON file.
+    Extensions without enough history are estimated by compressing a few files with LZ4.
+    """
+
+    FILE_NAME = "pigroman_ratios.json"
+
+    # Extensions with at least this many bytes of history are not sampled
+    MIN_HISTORY_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, path: str):
+        """
+        Loads the ratios of the previous runs, if any
+
+        :param path: path of the JSON file with the history
+        """
+        self.path = path
+        # extension -> [raw bytes, stored bytes]
+        self.history: Dict[str, List[int]] = {}
+        if os.path.isfile(path):
+            with open(path, "r") as f:
+                self.history = json.load(f)
+
+    @staticmethod
+    def extension(file: File) -> str:
+        return os.path.splitext(file.name)[1].lower()
+
+    def ratio(self, extension: str) -> float:
+        """
+        :param extension: file extension, with the leading dot
+        :return: stored size / raw size of the files with that extension. 1 if unknown.
+        """
+        raw, stored = self.history.get(extension, (0, 0))
+        return stored / raw if raw > 0 else 1.0
+
+    def sample(self, files: Iterable[File], max_files: int = 16, max_size: int = 64 * 1024 * 1024) -> int:
+        """
+        Compresses a few files of each extension that doesn't have enough history, and adds them to the history.
+        The same files get picked if nothing changed.
+
+        :param files: files that will be packed
+        :param max_files: max number of files compressed for each extension
+        :param max_size: max number of bytes compressed for each extension
+        :return: number of files compressed
+        """
+        by_extension: Dict[str, List[File]] = defaultdict(list)
+        for file in files:
+            if file.size > bsa.BSAFile.COMPRESS_THRESHOLD:
+                by_extension[self.extension(file)].append(file)
+        sampled = 0
+        rng = random.Random(0)
+        for extension, extension_files in sorted(by_extension.items()):
+            raw, stored = self.history.get(extension, (0, 0))
+            if raw >= self.MIN_HISTORY_SIZE:
+                continue
+            sampled_size = 0
+            for file in rng.sample(extension_files, min(max_files, len(extension_files))):
+                if sampled_size > 0 and sampled_size + file.size > max_size:
+                    continue
+                sampled_size += file.size
+                raw += file.size
+                stored += len(bsa.compress_file(file.path, bsa.Game.SKYRIM_SE))
+                sampled += 1
+            self.history[extension] = [raw, stored]
+        return sampled
+
+    def estimate(self, file: File) -> int:
+        """
+        :param file: a file
+        :return: estimated size of the file in a compressed archive, in bytes
+        """
+        if file.size <= bsa.BSAFile.COMPRESS_THRESHOLD:
+            # Stored uncompressed
+            return file.size
+        return int(file.size * self.ratio(self.extension(file))) + 1
+
+    def learn(self, archive_paths: Iterable[str], files: Dict[str, File]) -> None:
+        """
+        Replaces the history of the extensions in some archives with their actual compression ratio
+
+        :param archive_paths: paths of the compressed archives created by this run
+        :param files: relative path of each packed file (folder\\file name) -> File
+        :return:
+        """
+        learnt: Dict[str, List[int]] = defaultdict(lambda: [0, 0])
+        for archive_path in archive_paths:
+            with bsa.BSAReader(archive_path) as reader:
+                for i, path in enumerate(reader.paths()):
+                    file = files.get(path)
+                    if file is None or not reader.is_compressed(i):
+                        continue
+                    raw_stored = learnt[self.extension(file)]
+                    raw_stored[0] += file.size
+                    raw_stored[1] += len(reader.raw_data(i))
+        self.history.update(learnt)
+
+    def save(self) -> None:
+        with open(self.path, "w") as f:
+            json.dump(self.history, f, indent=2, sort_keys=True)
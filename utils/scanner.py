@@ -0,0 +1,134 @@
+import os
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from utils.files import File, is_ascii
+from utils.filters import FileFilter
+
+# (directory path, [(file path, lstat result)], [skipped file paths], [subdirectory paths])
+Listing = Tuple[str, List[Tuple[str, os.stat_result]], List[str], List[str]]
+
+
+class Scanner:
+    """
+    Walks one or more "Data" subfolders and yields a File for each file that has to be packed.
+
+    Directories are listed with os.scandir by a bounded thread pool, so the subfolders of
+    a directory are already being listed while its files are yielded.
+    Each file costs at most one stat call (none on Windows, where scandir returns
+    the file size together with the directory listing).
+    Files are always yielded in the same order (the same order as a top-down os.walk,
+    with entries sorted by name), regardless of the number of workers.
+    Folders skipped by the filter are never listed.
+    """
+
+    def __init__(self, data_path: str, file_filter: Optional[FileFilter] = None, max_workers: int = 4):
+        """
+        Initializes a new Scanner
+
+        :param data_path: absolute path of the "Data" folder
+        :param file_filter: decides which folders are listed and which files are yielded. Default: all of them.
+        :param max_workers: max number of directories that can be listed at the same time
+        """
+        self.data_path = data_path
+        self.file_filter = file_filter if file_filter is not None else FileFilter(data_path)
+        self.max_workers = max_workers
+
+        self.files_count = 0
+        self.bytes_count = 0
+        self.elapsed = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        """
+        Throughput of the last scan, in files per second
+
+        :return:
+        """
+        return self.files_count / self.elapsed if self.elapsed > 0 else 0.0
+
+    @staticmethod
+    def list_dir(path: str) -> Listing:
+        """
+        Lists a single directory, without recursing into its subdirectories.
+        Symlinks to directories are not followed, symlinks to files and
+        hidden files are reported as skipped.
+
+        :param path: absolute path of the directory to list
+        :return: a Listing tuple. Files and subdirectories are sorted by name.
+        """
+        files = []
+        skipped = []
+        dirs = []
+        try:
+            with os.scandir(path) as it:
+                entries = sorted(it, key=lambda x: x.name)
+        except OSError:
+            # Same as os.walk, ignore folders that cannot be listed
+            return path, files, skipped, dirs
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        dirs.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False) or entry.name.startswith("."):
+                    skipped.append(entry.path)
+                    continue
+                files.append((entry.path, entry.stat(follow_symlinks=False)))
+            except OSError:
+                skipped.append(entry.path)
+        return path, files, skipped, dirs
+
+    def _skip_folder(self, path: str) -> bool:
+        rule = self.file_filter.skip_folder(path)
+        if rule is not None:
+            print(f"! Skipped subfolder {path.lower()} ({rule.description})")
+        return rule is not None
+
+    def scan(self, folders: List[str]) -> Iterator[File]:
+        """
+        Walks the specified folders and yields a File object for each valid file
+
+        :param folders: absolute paths of the folders to walk
+        :return: File objects, in a deterministic order
+        """
+        self.files_count = 0
+        self.bytes_count = 0
+        st = time.monotonic()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                # Depth-first stack of pending listings. Popping from the end keeps os.walk's order.
+                stack: List[Future] = [
+                    executor.submit(self.list_dir, x) for x in reversed(folders) if not self._skip_folder(x)
+                ]
+                while stack:
+                    root, files, skipped, dirs = stack.pop().result()
+
+                    # Start listing the subfolders while we process this one. Skipped subfolders are never listed.
+                    stack.extend(executor.submit(self.list_dir, x) for x in reversed(dirs) if not self._skip_folder(x))
+
+                    for file_path in skipped:
+                        print(f"! Skipped {file_path.lower()}")
+
+                    for file_path, stat in files:
+                        if self.file_filter.skip_file(file_path, stat.st_size) is not None:
+                            continue
+                        # Print a warning if the file name contains non-ascii characters, as they may cause issues
+                        if not is_ascii(file_path):
+                            print(f"! Non-ASCII file name ({file_path.lower()})")
+                        self.files_count += 1
+                        self.bytes_count += stat.st_size
+                        yield File(
+                            file_path,
+                            base_dir=self.data_path,
+                            size=stat.st_size,
+                            mtime_ns=stat.st_mtime_ns
+                        )
+
+                        # Print progress every 1000 items
+                        if self.files_count % 1000 == 0:
+                            print(f"* Processed {self.files_count} files")
+        finally:
+            self.elapsed = time.monotonic() - st
@@ -0,0 +1,274 @@
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from enum import Enum
+from threading import Event
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from utils.backends import Backend
+from utils.files import ListSize
+from utils.metrics import Metrics
+
+
+class JobStatus(Enum):
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+JobResult = namedtuple("JobResult", "block_i status exit_code seconds")
+
+# Seconds between two checks of the cancel event, while waiting for the blocks
+CANCEL_POLL_INTERVAL = 0.2
+
+
+class Cancelled(Exception):
+    """
+    Raised when a build is cancelled with its cancel event
+    """
+    pass
+
+
+def check_cancelled(cancel: Optional[Event]) -> None:
+    """
+    :param cancel: the cancel event of the build, if any
+    :raises Cancelled: if the event is set
+    """
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+def pack_batch(
+    packer: Backend, blocks: List[int], lists_sizes: Sequence[ListSize], metrics: Metrics,
+    files_list_paths: Optional[List[str]] = None
+) -> Tuple[int, float]:
+    """
+    Packs a batch of blocks with a single packer run, and records its timing in metrics. Runs in a worker thread.
+
+    :param packer: the backend that packs the blocks
+    :param blocks: indexes of the blocks in the batch
+    :param lists_sizes: size of each block's files list
+    :param metrics: where the batch's timing is recorded
+    :param files_list_paths: path of each block's files list. Default: out_{i}.txt in the working directory.
+    :return: (exit code of the packer, elapsed seconds)
+    """
+    with metrics.phase(
+        f"block{'s' if len(blocks) > 1 else ''} {', '.join(str(x) for x in blocks)}",
+        sum(lists_sizes[i].files_count for i in blocks),
+        sum(lists_sizes[i].size for i in blocks)
+    ) as phase:
+        if files_list_paths is None:
+            files_list_paths = [f"out_{i}.txt" for i in blocks]
+        exit_code = packer.pack_many(blocks, files_list_paths)
+        archive_paths = [packer.archive_path(i) for i in blocks]
+        phase.extra["exit_code"] = exit_code
+        phase.extra["archive_size"] = sum(os.path.getsize(x) for x in archive_paths if os.path.isfile(x))
+    return exit_code, phase.seconds
+
+
+def collect_result(future: Future, batch: List[int], results: Dict[int, JobResult], blocks_count: int) -> bool:
+    """
+    Stores the result of a finished (or cancelled) pack_batch in results, and prints it
+
+    :param future: future of the pack_batch call
+    :param batch: indexes of the blocks in the batch
+    :param results: block index -> JobResult of the blocks finished so far
+    :param blocks_count: number of blocks, to print the progress
+    :return: False if the batch failed, True otherwise
+    """
+    name = f"block{'s' if len(batch) > 1 else ''} {', '.join(str(x) for x in batch)}"
+    if future.cancelled():
+        results.update((i, JobResult(i, JobStatus.CANCELLED, None, 0.0)) for i in batch)
+        return True
+    try:
+        exit_code, seconds = future.result()
+    except Exception as e:
+        print(f"! Could not pack {name}: {e}")
+        exit_code, seconds = None, 0.0
+    if exit_code == 0:
+        results.update((i, JobResult(i, JobStatus.DONE, exit_code, seconds)) for i in batch)
+        packed = sum(1 for x in results.values() if x.status == JobStatus.DONE)
+        print(f"* Packed {name} in {seconds:.2f} s ({packed}/{blocks_count})")
+        return True
+    results.update((i, JobResult(i, JobStatus.FAILED, exit_code, seconds)) for i in batch)
+    if exit_code is not None:
+        print(f"! Could not pack {name}, exit code {exit_code}")
+    return False
+
+
+def schedule_blocks(
+    packer: Backend, lists_sizes: List[ListSize], max_workers: int, metrics: Metrics, batch_size: int = 1,
+    cancel: Optional[Event] = None
+) -> List[JobResult]:
+    """
+    Packs all blocks, at most max_workers at the same time.
+    The biggest blocks are started first, so the last running blocks are the small ones
+    and the total time is as close as possible to the total size divided by max_workers.
+    If a block fails, the blocks that haven't started yet are cancelled, and the ones
+    already running are allowed to finish. The same happens on Ctrl-C (KeyboardInterrupt is re-raised)
+    and when the cancel event is set (Cancelled is raised).
+    With batch_size > 1, blocks of similar size are packed in batches, with a single packer run per batch.
+    Blocks with an empty files list have no archive, so they're not packed.
+
+    :param packer: the backend that packs the blocks
+    :param lists_sizes: size of each block's files list
+    :param max_workers: max number of blocks packed at the same time
+    :param metrics: where the timing of each batch is recorded
+    :param batch_size: max number of blocks packed by each packer run
+    :param cancel: if set, the blocks that haven't started yet are cancelled
+    :return: a JobResult for each block, sorted by block index
+    """
+    order = sorted(
+        (i for i, x in enumerate(lists_sizes) if x.files_count > 0), key=lambda i: lists_sizes[i].size, reverse=True
+    )
+    batches = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+    batches.sort(key=lambda x: sum(lists_sizes[i].size for i in x), reverse=True)
+    results: Dict[int, JobResult] = {
+        i: JobResult(i, JobStatus.DONE, 0, 0.0) for i, x in enumerate(lists_sizes) if x.files_count == 0
+    }
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures: Dict[Future, List[int]] = {}
+    try:
+        for batch in batches:
+            futures[executor.submit(pack_batch, packer, batch, lists_sizes, metrics)] = batch
+        pending = set(futures)
+        while pending:
+            done, pending = wait(
+                pending, timeout=CANCEL_POLL_INTERVAL if cancel is not None else None, return_when=FIRST_COMPLETED
+            )
+            check_cancelled(cancel)
+            for future in done:
+                batch = futures[future]
+                if collect_result(future, batch, results, len(lists_sizes)):
+                    continue
+                # Fail fast, don't start the other blocks
+                for other in pending:
+                    other.cancel()
+    except (KeyboardInterrupt, Cancelled) as e:
+        print(
+            f"! {'Cancelled' if isinstance(e, Cancelled) else 'Interrupted'}, waiting for the running blocks to finish"
+        )
+        for future in futures:
+            future.cancel()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+    for i in order:
+        if i not in results:
+            results[i] = JobResult(i, JobStatus.CANCELLED, None, 0.0)
+    return [results[i] for i in sorted(results)]
+
+
+class BlockPipeline:
+    """
+    Packs the blocks as soon as they're ready, at most max_workers at the same time,
+    while the next blocks are still being planned. The blocks are packed in the order they're added.
+    Like schedule_blocks, if a block fails the blocks that haven't started yet are cancelled,
+    the ones already running are allowed to finish, and the blocks added later are not packed.
+    Used as a context manager: on exit, the running blocks are waited for.
+    """
+
+    def __init__(
+        self, packer: Backend, max_workers: int, metrics: Metrics, batch_size: int = 1, cancel: Optional[Event] = None
+    ):
+        """
+        :param packer: the backend that packs the blocks
+        :param max_workers: max number of blocks packed at the same time
+        :param metrics: where the timing of each batch is recorded
+        :param batch_size: max number of blocks packed by each packer run
+        :param cancel: if set while waiting for the blocks, Cancelled is raised
+        """
+        self.packer = packer
+        self.cancel = cancel
+        self.metrics = metrics
+        self.batch_size = batch_size
+        # Size of each block's files list, by block index
+        self.lists_sizes: List[ListSize] = []
+        self.failed = False
+        self._files_list_paths: List[str] = []
+        self._batch: List[int] = []
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: Dict[Future, List[int]] = {}
+        self._pending: Set[Future] = set()
+        self._results: Dict[int, JobResult] = {}
+
+    def __enter__(self) -> "BlockPipeline":
+        return self
+
+    def __exit__(self, exc_type, *_) -> None:
+        if exc_type is not None:
+            if issubclass(exc_type, (KeyboardInterrupt, Cancelled)):
+                print(
+                    f"! {'Cancelled' if issubclass(exc_type, Cancelled) else 'Interrupted'}, "
+                    "waiting for the running blocks to finish"
+                )
+            for future in self._futures:
+                future.cancel()
+        self._executor.shutdown(wait=True)
+
+    def add(self, list_size: ListSize, files_list_path: str) -> int:
+        """
+        Adds a block, whose files list has already been written. It's packed as soon as a worker is free
+        (or as soon as the batch is full).
+
+        :param list_size: size of the block's files list
+        :param files_list_path: path of the block's files list
+        :return: index of the block
+        """
+        block_i = len(self.lists_sizes)
+        self.lists_sizes.append(list_size)
+        self._files_list_paths.append(files_list_path)
+        self._batch.append(block_i)
+        if len(self._batch) >= self.batch_size:
+            self._flush()
+        self._collect(timeout=0)
+        return block_i
+
+    def _flush(self) -> None:
+        batch = self._batch
+        self._batch = []
+        if not batch:
+            return
+        if self.failed:
+            self._results.update((i, JobResult(i, JobStatus.CANCELLED, None, 0.0)) for i in batch)
+            return
+        future = self._executor.submit(
+            pack_batch, self.packer, batch, self.lists_sizes, self.metrics,
+            [self._files_list_paths[i] for i in batch]
+        )
+        self._futures[future] = batch
+        self._pending.add(future)
+
+    def _collect(self, timeout: Optional[float]) -> None:
+        """
+        Collects the results of the finished batches
+
+        :param timeout: seconds to wait for a batch to finish. None waits for all batches.
+        :return:
+        """
+        while self._pending:
+            if timeout is None and self.cancel is not None:
+                done, self._pending = wait(self._pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                check_cancelled(self.cancel)
+            else:
+                done, self._pending = wait(self._pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    return
+            for future in done:
+                if not collect_result(future, self._futures[future], self._results, len(self.lists_sizes)):
+                    # Fail fast, don't start the other blocks
+                    self.failed = True
+                    for other in self._pending:
+                        other.cancel()
+
+    def finish(self) -> List[JobResult]:
+        """
+        Packs the last batch and waits for all blocks to be packed
+
+        :return: a JobResult for each block, sorted by block index
+        """
+        self._flush()
+        self._collect(timeout=None)
+        return [
+            self._results.get(i, JobResult(i, JobStatus.CANCELLED, None, 0.0)) for i in range(len(self.lists_sizes))
+        ]
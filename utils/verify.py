@@ -0,0 +1,164 @@
+import os
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import xxhash
+
+import bsa
+from utils.hashing import file_hash
+
+VerifyResult = namedtuple("VerifyResult", "archive_path files missing extra mismatched elapsed")
+
+
+def manifest_path(archive_path: str) -> str:
+    """
+    :param archive_path: path of an archive
+    :return: path of the archive's checksums manifest
+    """
+    return f"{archive_path}.xxh64"
+
+
+def normalize_path(path: str) -> str:
+    """
+    Normalizes a path the same way it's stored in the archives
+
+    :param path: path of a file, relative to the "Data" folder
+    :return: normalized path (folder\\file name)
+    """
+    return "\\".join(x for x in bsa.BSAReader.split_path(path) if x)
+
+
+def read_files_list(files_list_path: str) -> List[str]:
+    """
+    Reads a files list, and normalizes its paths the same way they're stored in the archives
+
+    :param files_list_path: path of the files list
+    :return: list of paths (folder\\file name)
+    """
+    with open(files_list_path, "r") as f:
+        return [normalize_path(x) for x in f if x.strip()]
+
+
+def entry_hash(reader: bsa.BSAReader, i: int) -> int:
+    """
+    Hashes the data of a file in an archive, one chunk at a time
+
+    :param reader: the archive
+    :param i: index of the file record
+    :return: xxhash of the file's data
+    """
+    h = xxhash.xxh64()
+    # The chunks are views of the mapped archive, they are released when this function returns
+    for chunk in reader.read_chunks(i):
+        h.update(chunk)
+    return h.intdigest()
+
+
+def verify_archive(
+    archive_path: str, files_list_path: str, data_path: str, source_hashes: Optional[Dict[str, int]] = None,
+    source_paths: Optional[Dict[str, str]] = None
+) -> VerifyResult:
+    """
+    Checks that an archive contains exactly the files in its files list, with the right data,
+    and writes a manifest with the xxhash of each file in the archive.
+    Both the archive entries and the source files are hashed in chunks.
+    This is a module-level function so it can run in a process pool.
+
+    :param archive_path: path of the archive
+    :param files_list_path: path of the archive's files list
+    :param data_path: absolute path of the "Data" folder
+    :param source_hashes: known xxhashes of the source files (normalized relative path -> hash).
+                          Files that are not in here get hashed.
+    :param source_paths: absolute paths of the source files, as they are on disk (normalized relative path -> path).
+                         Paths in the archives are lower case, so they can't be used to open the source files
+                         on case-sensitive file systems. Files that are not in here are looked for in data_path.
+    :return: a VerifyResult
+    """
+    st = time.monotonic()
+    if source_hashes is None:
+        source_hashes = {}
+    if source_paths is None:
+        source_paths = {}
+    expected = read_files_list(files_list_path)
+    missing = []
+    mismatched = []
+    with bsa.BSAReader(archive_path) as reader, open(manifest_path(archive_path), "w") as manifest:
+        extra = set(reader.paths()) - set(expected)
+        for path in expected:
+            i = reader.find(path)
+            if i is None:
+                missing.append(path)
+                continue
+            try:
+                archive_hash = entry_hash(reader, i)
+            except (RuntimeError, zlib.error):
+                # Corrupted compressed data
+                mismatched.append(path)
+                continue
+            source_hash = source_hashes.get(path)
+            if source_hash is None:
+                source_path = source_paths.get(path)
+                if source_path is None:
+                    source_path = os.path.join(data_path, path.replace("\\", os.sep))
+                source_hash = file_hash(source_path)
+            if archive_hash != source_hash:
+                mismatched.append(path)
+            manifest.write(f"{archive_hash:016x}  {path}\n")
+    return VerifyResult(archive_path, len(expected), missing, sorted(extra), mismatched, time.monotonic() - st)
+
+
+def verify_archives(
+    archives: Dict[str, str], data_path: str, max_workers: int = 1,
+    source_hashes: Optional[Dict[str, int]] = None, source_paths: Optional[Dict[str, str]] = None
+) -> bool:
+    """
+    Verifies some archives in a process pool, one archive per worker, and prints the results
+
+    :param archives: archive path -> files list path. Archives that don't exist are removed.
+    :param data_path: absolute path of the "Data" folder
+    :param max_workers: max number of archives verified at the same time
+    :param source_hashes: known xxhashes of the source files (normalized relative path -> hash)
+    :param source_paths: absolute paths of the source files, as they are on disk (normalized relative path -> path)
+    :return: True if all archives are valid, False otherwise
+    """
+    if source_hashes is None:
+        source_hashes = {}
+    if source_paths is None:
+        source_paths = {}
+    ok = True
+    st = time.monotonic()
+    for archive_path in [x for x in archives if not os.path.isfile(x)]:
+        print(f"! Missing archive: {archive_path}")
+        del archives[archive_path]
+        ok = False
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for archive_path, files_list_path in archives.items():
+            # Send each worker only the hashes and the paths it needs
+            expected = read_files_list(files_list_path)
+            futures.append(executor.submit(
+                verify_archive, archive_path, files_list_path, data_path,
+                {x: source_hashes[x] for x in expected if x in source_hashes},
+                {x: source_paths[x] for x in expected if x in source_paths}
+            ))
+        for future in futures:
+            result = future.result()
+            if result.missing or result.extra or result.mismatched:
+                ok = False
+                print(
+                    f"! {result.archive_path}: {len(result.missing)} missing, {len(result.extra)} unexpected, "
+                    f"{len(result.mismatched)} different files"
+                )
+                for path in result.missing:
+                    print(f"! Missing: {path}")
+                for path in result.extra:
+                    print(f"! Unexpected: {path}")
+                for path in result.mismatched:
+                    print(f"! Different: {path}")
+            else:
+                print(f"* Verified {result.archive_path} ({result.files} files) in {result.elapsed:.2f} s")
+    print(f"* Verified {len(archives)} archives in {time.monotonic() - st:.2f} s")
+    return ok